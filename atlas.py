@@ -0,0 +1,155 @@
+"""
+Packs the surfaces of every tile on a play surface into a few large atlas surfaces, and
+points the tiles at subsurfaces of the atlas instead.  Subsurfaces blit exactly like the
+surfaces they replace, so nothing else needs to know about the atlas, but the pixels of
+a whole layout end up in a handful of allocations instead of one per surface.
+"""
+
+import pygame_setup
+import pygame
+
+import surface_tools
+
+
+# The largest height of an atlas page.  Surfaces taller than this are left as they are.
+PAGE_LIMIT = 4096
+
+
+
+
+class TileAtlas:
+    """
+    Packs the distinct surfaces referenced by a list of tiles into atlas pages.
+    Surfaces are grouped by pixel format, since a page can only hold one format, and
+    then by width.  Each page is a single column of surfaces of one width stacked top
+    to bottom and cropped to the height of the stack, so no page pixel is wasted and
+    every surface keeps the pitch it had on its own, which keeps blits from the atlas
+    as fast as blits from separate surfaces.  A surface whose width no other surface
+    shares is left as it is, as a page holding it alone would gain nothing.
+
+    The surfaces a tile owns are the ones in its `draw_params`, plus the ones named by
+    its `surface_attrs`.  All of them are replaced with subsurfaces of the atlas, as are
+    the matching entries in the surface vault so that later lookups return the atlas
+    version.
+    """
+
+
+    def __init__(self, tiles):
+        """
+        This is a cold path.
+        """
+
+        surfaces = {}
+        for tile in tiles:
+            for surface, rect in tile.draw_params:
+                surfaces[id(surface)] = surface
+            for attr in tile.surface_attrs:
+                surface = getattr(tile, attr, None)
+                if surface is not None:
+                    surfaces[id(surface)] = surface
+
+        columns = {}
+        self.unpacked = 0
+        for surface in surfaces.values():
+            w, h = surface.get_size()
+            if w and h and h <= PAGE_LIMIT:
+                fmt = (surface.get_bitsize(), surface.get_flags() & pygame.SRCALPHA, surface.get_masks())
+                columns.setdefault((fmt, w), []).append(surface)
+            else:
+                self.unpacked += 1
+
+        # A list of atlas surfaces.
+        self.pages = []
+
+        # Maps the id of each packed surface to its replacement subsurface.
+        mapping = {}
+
+        self.packed = 0
+        self.source_bytes = 0
+        self.used_pixels = 0
+
+        for column in columns.values():
+            for page, placements in self.__pack(column):
+                if len(placements) < 2:
+                    self.unpacked += len(placements)
+                    continue
+                alpha = page.get_flags() & pygame.SRCALPHA
+                for surface, position in placements:
+                    if alpha:
+                        page.blit(surface, position, special_flags=pygame.BLEND_RGBA_MAX)
+                    else:
+                        page.blit(surface, position)
+                    mapping[id(surface)] = page.subsurface(pygame.Rect(position, surface.get_size()))
+                    self.packed += 1
+                    self.source_bytes += surface.get_pitch() * surface.get_height()
+                    self.used_pixels += surface.get_width() * surface.get_height()
+                self.pages.append(page)
+
+        for tile in tiles:
+            tile.draw_params = [(mapping.get(id(surface), surface), rect) for surface, rect in tile.draw_params]
+            for attr in tile.surface_attrs:
+                surface = getattr(tile, attr, None)
+                if surface is not None:
+                    setattr(tile, attr, mapping.get(id(surface), surface))
+
+        surface_tools.SURFACE_VAULT.remap(mapping)
+
+
+    @staticmethod
+    def __pack(column):
+        """
+        Yields `(page, placements)` for each page needed to stack the surfaces in
+        `column`, which must all share a width and pixel format.  Each placement is a
+        `(surface, (x, y))` tuple.  The page is None for a stack of a single surface.
+        """
+
+        placements = []
+        y = 0
+
+        for surface in column:
+            h = surface.get_height()
+            if y + h > PAGE_LIMIT:
+                yield TileAtlas.__page(y, placements), placements
+                placements = []
+                y = 0
+            placements.append((surface, (0, y)))
+            y += h
+
+        if placements:
+            yield TileAtlas.__page(y, placements), placements
+
+
+    @staticmethod
+    def __page(h, placements):
+        if len(placements) < 2:
+            return None
+        like = placements[0][0]
+        page = pygame.Surface((like.get_width(), h), like.get_flags() & pygame.SRCALPHA, like)
+        page.fill((0, 0, 0, 0))
+        return page
+
+
+
+
+    def atlas_bytes(self):
+        return sum(page.get_pitch() * page.get_height() for page in self.pages)
+
+
+    def report(self):
+        """
+        Returns a printable summary of how well the surfaces were packed.  The fill
+        efficiency is the fraction of atlas pixels holding a surface.  The byte counts
+        cover pixel data only, so with every page fully filled they match, and what the
+        atlas saves is the separate pixel allocation of each packed surface.
+        """
+        atlas_bytes = self.atlas_bytes()
+        page_pixels = sum(page.get_width() * page.get_height() for page in self.pages)
+        fill = self.used_pixels / page_pixels if page_pixels else 0.0
+        saved = self.source_bytes - atlas_bytes
+        sizes = ", ".join(f"{page.get_width()}x{page.get_height()}" for page in self.pages)
+        return (
+            f"Atlas: {self.packed} surfaces in {len(self.pages)} pages ({sizes}), "
+            f"{self.unpacked} left unpacked, {fill:.1%} filled, "
+            f"{atlas_bytes / 2**20:.2f} MiB vs {self.source_bytes / 2**20:.2f} MiB separately "
+            f"({saved / 2**20:+.2f} MiB saved), "
+            f"{len(self.pages)} pixel allocations instead of {self.packed}")
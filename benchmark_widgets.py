@@ -0,0 +1,335 @@
+"""
+Replays synthetic multi-finger touch streams through the stock instruments and reports
+how long each stage of the main loop takes.  This runs on SDL's dummy video driver with
+the null MIDI backend, so it needs neither a screen nor MIDI hardware.
+
+Run with `python benchmark_widgets.py`.
+"""
+
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+os.environ["MOLLYTIME_MIDI"] = "null"
+
+import pygame_setup
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+import pygame
+
+import midi
+import surface_tools
+from widgets import PlaySurface, Plato
+from piano import Piano
+from pads import PadArray
+from roller import RollerPlate, MPERollerPlate
+
+
+SCREEN_SIZE = (1920, 1080)
+SCALING_SCREEN_SIZE = (3840, 2160)
+PIANO_SCALE = [2, 1, 2, 2, 2, 1, 2]
+SCALING_LAYOUTS = (
+    ("pads 8x4", lambda: [PadArray(0, 0, 8, 4, 60, 2, 3)]),
+    ("pads 16x8", lambda: [PadArray(0, 0, 16, 8, 60, 2, 3)]),
+    ("pads 32x16", lambda: [PadArray(0, 0, 32, 16, 60, 2, 3)]),
+    ("pads 64x32", lambda: [PadArray(0, 0, 64, 32, 60, 2, 3)]),
+    ("piano 25", lambda: [Piano(0, 0, 48, PIANO_SCALE, 25)]),
+    ("piano 49", lambda: [Piano(0, 0, 36, PIANO_SCALE, 49)]),
+    ("piano 88", lambda: [Piano(0, 0, 21, [2, 1, 2, 2, 1, 2, 2], 88)]))
+FRAMES = 600
+SEED = 1234
+
+
+
+
+def piano_layout():
+    root = 60
+    scale = [2, 1, 2, 2, 2, 1, 2]
+    notes = 12 * 2 + 1
+    return [
+        Piano(0, 0, root - 12, scale, notes),
+        Piano(0, 9, root, scale, notes),
+        Piano(0, 18, root + 12, scale, notes)]
+
+
+def pads_layout():
+    return [PadArray(0, 0, 31, 9, 60, 2, 3)]
+
+
+def roller_layout():
+    return [RollerPlate(0, 13 * -i, 24 + 12 * i, 13) for i in range(7)]
+
+
+def mpe_roller_layout():
+    zone = midi.MPEZone()
+    return [MPERollerPlate(0, 13 * -i, zone, 24 + 12 * i, 13) for i in range(7)]
+
+
+LAYOUTS = (
+    ("piano", piano_layout),
+    ("pads", pads_layout),
+    ("roller", roller_layout),
+    ("mpe", mpe_roller_layout))
+
+
+
+
+def finger(event_type, finger_id, x, y):
+    return pygame.event.Event(
+        event_type, touch_id=0, finger_id=finger_id, x=x, y=y, dx=0.0, dy=0.0, pressure=1.0)
+
+
+def taps(rng):
+    """
+    A finger comes down somewhere new every other frame, and lifts in between.
+    """
+    frames = []
+    for index in range(FRAMES // 2):
+        frames.append([finger(pygame.FINGERDOWN, 0, rng.random(), rng.random())])
+        frames.append([finger(pygame.FINGERUP, 0, 0.0, 0.0)])
+    return frames
+
+
+def glissandos(rng):
+    """
+    A finger sweeps across the screen with several motion events per frame.
+    """
+    frames = []
+    steps = 60
+    while len(frames) < FRAMES:
+        y = rng.random()
+        frames.append([finger(pygame.FINGERDOWN, 0, 0.0, y)])
+        for step in range(steps):
+            frames.append([
+                finger(pygame.FINGERMOTION, 0, (step + part / 3) / steps, y)
+                for part in range(3)])
+        frames.append([finger(pygame.FINGERUP, 0, 1.0, y)])
+    return frames[:FRAMES]
+
+
+def rubs(rng):
+    """
+    Ten fingers come down together and wiggle with two motion events each per frame.
+    """
+    frames = []
+    while len(frames) < FRAMES:
+        points = [[rng.random(), rng.random()] for finger_id in range(10)]
+        frames.append([finger(pygame.FINGERDOWN, finger_id, x, y) for finger_id, (x, y) in enumerate(points)])
+        for step in range(60):
+            events = []
+            for part in range(2):
+                for finger_id, point in enumerate(points):
+                    point[0] = min(max(point[0] + rng.uniform(-.002, .002), 0.0), 1.0)
+                    point[1] = min(max(point[1] + rng.uniform(-.002, .002), 0.0), 1.0)
+                    events.append(finger(pygame.FINGERMOTION, finger_id, *point))
+            frames.append(events)
+        frames.append([finger(pygame.FINGERUP, finger_id, x, y) for finger_id, (x, y) in enumerate(points)])
+    return frames[:FRAMES]
+
+
+STREAMS = (
+    ("taps", taps),
+    ("glissandos", glissandos),
+    ("ten finger rubs", rubs))
+
+
+
+
+def run_stream(screen, play_surface, frames):
+    """
+    Feeds each frame of events through the play surface the same way the main loop in
+    `Instrument.__call__` does, and returns the total time spent in each stage and the
+    number of events fed in.
+    """
+
+    timings = {"coalesce": 0.0, "input_event": 0.0, "crank": 0.0, "present": 0.0}
+    events_in = 0
+
+    clock = time.perf_counter
+    for events in frames:
+        events_in += len(events)
+
+        start = clock()
+        events = play_surface.coalesce_events(events)
+        coalesced = clock()
+        for event in events:
+            play_surface.input_event(event)
+        routed = clock()
+        update_rects, blit_sequence = play_surface.crank()
+        cranked = clock()
+        if blit_sequence:
+            screen.blits(blit_sequence=blit_sequence)
+            pygame.display.update(update_rects)
+        presented = clock()
+
+        timings["coalesce"] += coalesced - start
+        timings["input_event"] += routed - coalesced
+        timings["crank"] += cranked - routed
+        timings["present"] += presented - cranked
+
+    return timings, events_in
+
+
+def measure_allocations(play_surface, frames):
+    """
+    Feeds the frames through the play surface again, and returns the mean number of
+    memory blocks each crank left allocated, as counted by the play surface, and the
+    mean peak of memory allocated during each crank in bytes, as traced by tracemalloc.
+    Both are measured in a separate pass since measuring slows things down.
+    """
+
+    blocks = 0
+    peak = 0
+    play_surface.count_allocations = True
+    tracemalloc.start()
+
+    for events in frames:
+        for event in play_surface.coalesce_events(events):
+            play_surface.input_event(event)
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        play_surface.crank()
+        peak += tracemalloc.get_traced_memory()[1] - current
+        blocks += play_surface.allocations
+
+    tracemalloc.stop()
+    play_surface.count_allocations = False
+    return blocks / len(frames), peak / len(frames)
+
+
+def tile_memory(play_surface):
+    """
+    Returns the mean size in bytes of a tile object, including its `__dict__` if it has
+    one and its draw_params list, but not the surfaces and rects it shares.
+    """
+    total = 0
+    for tile in play_surface.tiles:
+        total += sys.getsizeof(tile)
+        if hasattr(tile, "__dict__"):
+            total += sys.getsizeof(tile.__dict__)
+        total += sys.getsizeof(tile.draw_params)
+        total += sum(sys.getsizeof(params) for params in tile.draw_params)
+    return total / len(play_surface.tiles)
+
+
+def time_test_point(play_surface, rng, count=20000):
+    points = [
+        (rng.randrange(play_surface.screen_w), rng.randrange(play_surface.screen_h))
+        for index in range(count)]
+    start = time.perf_counter()
+    for point in points:
+        play_surface.test_point(point)
+    return (time.perf_counter() - start) / count
+
+
+def time_match(play_surface, match, rng, count=2000):
+    """
+    Returns the mean time in seconds of calling `match(plate, point)` on points inside
+    the frame of the first plate.
+    """
+    plate = play_surface.plates[0]
+    frame = plate.frame
+    points = [
+        (rng.randrange(frame.left, frame.right), rng.randrange(frame.top, frame.bottom))
+        for index in range(count)]
+    start = time.perf_counter()
+    for point in points:
+        match(plate, point)
+    return (time.perf_counter() - start) / count
+
+
+def scaling():
+    """
+    Shows how hit testing scales with the number of tiles on a plate.
+    """
+    print(f"{'layout':<12} {'tiles':>6} {'startup':>10} {'scan match':>12} {'match':>10} {'test_point':>12}   (startup in ms, others in us)")
+    for layout_name, layout in SCALING_LAYOUTS:
+        start = time.perf_counter()
+        play_surface = PlaySurface(SCALING_SCREEN_SIZE, layout(), .5, 1)
+        startup = time.perf_counter() - start
+
+        scan = time_match(play_surface, Plato.match, random.Random(SEED))
+        match = time_match(play_surface, type(play_surface.plates[0]).match, random.Random(SEED))
+        test_point = time_test_point(play_surface, random.Random(SEED))
+        print(f"{layout_name:<12} {len(play_surface.tiles):>6} {startup * 1000:>10.1f} {scan * 1e6:>12.2f} {match * 1e6:>10.2f} {test_point * 1e6:>12.2f}")
+
+        surface_tools.reset_memo()
+    print()
+
+
+def shaping(screen):
+    """
+    Feeds the ten finger rubs through the roller layout with the MIDI traffic shaper
+    installed, and reports how many continuous messages it let through.  The frames are
+    fed in as fast as they can be processed, so the rate capped run is only indicative.
+    """
+
+    print(f"{'shaper':<24} {'delivered':>10} {'suppressed':>10}")
+    for name, min_interval in (("duplicates only", 0.0), ("capped at 500 Hz", 1 / 500)):
+        play_surface = PlaySurface(SCREEN_SIZE, roller_layout(), .5, 1)
+        shaper = midi.start_shaper(min_interval)
+        try:
+            run_stream(screen, play_surface, rubs(random.Random(SEED)))
+            midi.poll()
+        finally:
+            midi.stop_shaper()
+        print(f"{name:<24} {shaper.delivered:>10} {shaper.suppressed:>10}")
+        surface_tools.reset_memo()
+    print()
+
+
+def main():
+    pygame.init()
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+
+    print(f"{'layout':<8} {'stream':<16} {'events/sec':>12} {'coalesce':>10} {'input':>10} {'crank':>10} {'present':>10} {'blocks':>8} {'peak':>8}   (us, blocks, and bytes per frame)")
+
+    for layout_name, layout in LAYOUTS:
+        start = time.perf_counter()
+        play_surface = PlaySurface(SCREEN_SIZE, layout(), .5, 1)
+        startup = time.perf_counter() - start
+
+        screen.fill((0, 0, 0))
+        update_rects, blit_sequence = play_surface.draw()
+        start = time.perf_counter()
+        screen.blits(blit_sequence=blit_sequence)
+        pygame.display.flip()
+        full_draw = time.perf_counter() - start
+
+        for stream_name, stream in STREAMS:
+            frames = stream(random.Random(SEED))
+            timings, events_in = run_stream(screen, play_surface, frames)
+            blocks, peak = measure_allocations(play_surface, stream(random.Random(SEED)))
+            total = sum(timings.values())
+            stages = " ".join(f"{timings[stage] / len(frames) * 1e6:>10.1f}" for stage in ("coalesce", "input_event", "crank", "present"))
+            print(f"{layout_name:<8} {stream_name:<16} {events_in / total:>12,.0f} {stages} {blocks:>8.2f} {peak:>8.0f}")
+
+        test_point = time_test_point(play_surface, random.Random(SEED))
+        print(f"{layout_name:<8} {len(play_surface.tiles)} tiles of {tile_memory(play_surface):.0f} bytes, startup {startup * 1000:.1f} ms, full draw {full_draw * 1000:.2f} ms, test_point {test_point * 1e6:.2f} us")
+        vault = surface_tools.SURFACE_VAULT.stats()
+        print(f"{layout_name:<8} surface vault: {vault['surfaces']} surfaces ({vault['pinned']} pinned), {vault['bytes'] / 2**20:.1f} MiB, {vault['hits']} hits, {vault['misses']} misses, {vault['evictions']} evictions")
+
+        surface_tools.reset_memo()
+
+        play_surface = PlaySurface(SCREEN_SIZE, layout(), .5, 1, use_atlas=True)
+        screen.fill((0, 0, 0))
+        update_rects, blit_sequence = play_surface.draw()
+        start = time.perf_counter()
+        screen.blits(blit_sequence=blit_sequence)
+        pygame.display.flip()
+        atlas_draw = time.perf_counter() - start
+        print(f"{layout_name:<8} full draw from atlas {atlas_draw * 1000:.2f} ms")
+        print(f"{layout_name:<8} {play_surface.atlas.report()}")
+        print()
+
+        surface_tools.reset_memo()
+
+    shaping(screen)
+    scaling()
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
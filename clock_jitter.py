@@ -0,0 +1,80 @@
+"""
+Compares the timing of MIDI clock pulses paced with `time.sleep`, the way
+tempo_experiment.py does it, against pulses scheduled ahead of time on the ALSA
+sequencer queue.  The pulses are looped back into a second sequencer client and
+timestamped on arrival, so no MIDI hardware is needed.  This only works on Linux.
+"""
+
+import time
+import threading
+
+from alsa_midi import SequencerClient, WRITE_PORT, ClockEvent
+from alsa_midi.port import PortType
+
+import linux_midi
+from timing import RollingStats
+
+
+BPM = 120
+PULSES = 24 * 16
+INTERVAL = 60 / (BPM * 24)
+
+
+listener = SequencerClient("MollyTime Jitter")
+inbox = listener.create_port(
+    "input",
+    caps=WRITE_PORT,
+    type=PortType.APPLICATION | PortType.SOFTWARE | PortType.MIDI_GENERIC)
+linux_midi.port.connect_to(inbox)
+
+
+def receive(arrivals):
+    while len(arrivals) < PULSES:
+        event = listener.event_input(timeout=1)
+        if event is None:
+            break
+        if isinstance(event, ClockEvent):
+            arrivals.append(time.perf_counter())
+
+
+def sleep_paced():
+    for pulse in range(PULSES):
+        linux_midi.rt_clock()
+        linux_midi.flush()
+        time.sleep(INTERVAL)
+
+
+def queue_scheduled():
+    # Stay one beat ahead of the sequencer so that its buffers never fill up.
+    start, tick = linux_midi.queue_time()
+    start += INTERVAL * 24
+    for pulse in range(PULSES):
+        when = start + pulse * INTERVAL
+        linux_midi.schedule_message("rt_clock", real_time=when)
+        if pulse % 24 == 23:
+            linux_midi.flush()
+            while linux_midi.queue_time()[0] < when - INTERVAL * 24:
+                time.sleep(INTERVAL)
+    linux_midi.flush()
+
+
+def measure(label, send):
+    arrivals = []
+    receiver = threading.Thread(target=receive, args=(arrivals,))
+    receiver.start()
+    send()
+    receiver.join()
+
+    jitter = RollingStats(PULSES)
+    for earlier, later in zip(arrivals, arrivals[1:]):
+        jitter.add(abs((later - earlier) - INTERVAL))
+
+    drift = (arrivals[-1] - arrivals[0]) - INTERVAL * (len(arrivals) - 1)
+    print(f"{label}: {len(arrivals)} pulses received")
+    print(f"  interval error: {jitter}")
+    print(f"  drift over the run: {drift * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    measure("time.sleep pacing", sleep_paced)
+    measure("sequencer queue scheduling", queue_scheduled)
@@ -7,6 +7,9 @@ import rtmidi
 
 midiout = rtmidi.MidiOut()
 
+# Created by `open_input`.  Incoming messages are delivered by RtMidi's own thread.
+midiin = None
+
 
 def note_on(note, velocity, channel=0):
     """
@@ -53,7 +56,7 @@ def channel_pressure(pressure, channel=0):
     Arg `pressure` is an integer between 0 and 127 inclusive.
     Arg 'channel' is an integer between 0 and 15 inclusive.
     """
-    midiout.send_message([0xC0 | 0xF & channel, pressure])
+    midiout.send_message([0xD0 | 0xF & channel, pressure])
 
 
 def pitch_bend(bend, channel=0):
@@ -62,14 +65,14 @@ def pitch_bend(bend, channel=0):
     Arg 'channel' is an integer between 0 and 15 inclusive.
     """
 
-    # Educated guess based on what worked for the linux_midi backend.
-    bend = int(bind)
+    # The 14 bit bend value is centered on 0x2000.
+    bend = max(-1, min(bend, 1))
     if bend < 0:
-        bend = 0x3FFF - max(-1, abs(bend)) * 0x1FFF
-    elif bend > 0:
-        bend = min(bend, 1) * 0x1FFF
+        bend = 0x2000 + int(bend * 0x2000)
+    else:
+        bend = 0x2000 + int(bend * 0x1FFF)
 
-    midiout.send_message([0xC0 | 0xF & channel, bend & 0x7f, (bend >> 7) & 0x7f])
+    midiout.send_message([0xE0 | 0xF & channel, bend & 0x7F, bend >> 7])
 
 
 def rt_start():
@@ -105,6 +108,18 @@ def flush():
     pass
 
 
+def queue_time():
+    raise NotImplementedError("Scheduling messages needs the ALSA backend")
+
+
+def set_queue_tempo(bpm):
+    raise NotImplementedError("Scheduling messages needs the ALSA backend")
+
+
+def schedule_message(message, *args, tick=None, real_time=None):
+    raise NotImplementedError("Scheduling messages needs the ALSA backend")
+
+
 def _get_ports_and_aliases():
     found = []
     available_ports = midiout.get_ports()
@@ -126,15 +141,68 @@ def device_names():
     return midiout.get_ports()
 
 
+def _connect_input(target):
+    """
+    Opens the input port of the device called `target`, or a virtual input port if
+    there is no such device.
+    """
+    for index, name in enumerate(midiin.get_ports()):
+        m = re.match(f"^(.+) {str(index)}$", name)
+        if name == target or (m and m.groups()[0] == target):
+            midiin.open_port(index)
+            return
+    try:
+        midiin.open_virtual_port("MollyTime")
+    except NotImplementedError:
+        pass
+
+
 def auto_connect_inner(device_priority):
     available_ports = _get_ports_and_aliases()
     for target in device_priority:
         for index, name in available_ports:
             if name == target:
                 midiout.open_port(index)
+                if midiin is not None:
+                    _connect_input(target)
                 return name
     try:
         midiout.open_virtual_port("MollyTime")
     except NotImplementedError:
         pass
+    if midiin is not None:
+        _connect_input(None)
     return None
+
+
+def _receive(event, push):
+    """
+    The RtMidi input callback.  Arg `event` is a `(message, delta time)` tuple.
+    """
+    push(bytes(event[0]))
+
+
+def open_input(push):
+    """
+    Creates a MIDI input which calls `push` with the bytes of every message that
+    arrives on it, from RtMidi's input thread.  Call this before `auto_connect` to also
+    open the input of the device it connects to.
+    """
+    global midiin
+    if midiin is None:
+        midiin = rtmidi.MidiIn()
+        # SysEx and clock are let through, active sensing is not.
+        midiin.ignore_types(sysex=False, timing=False, active_sense=True)
+        midiin.set_callback(_receive, push)
+
+
+def close_input():
+    """
+    Closes the MIDI input.
+    """
+    global midiin
+    if midiin is not None:
+        midiin.cancel_callback()
+        midiin.close_port()
+        midiin.delete()
+        midiin = None
@@ -0,0 +1,258 @@
+"""
+Records the touch and mouse input of a play session to a compact binary log, and
+replays such logs through a PlaySurface so that a session can be reproduced exactly.
+
+A log starts with a header holding the screen size it was recorded on, followed by
+fixed size records of the event time in seconds since recording started, the finger
+id or mouse button, the normalized x and y coordinates, and an event code.  The high
+bit of the event code marks the first event of each batch fetched by the main loop, so
+replays crank the play surface at the same points the original session did.
+"""
+
+import sys
+import time
+import queue
+import struct
+import threading
+
+import pygame_setup
+import pygame
+
+
+MAGIC = b"MTIL"
+VERSION = 1
+HEADER = struct.Struct("<4sHHH")
+RECORD = struct.Struct("<dqffB")
+
+# Number of records buffered before they are handed to the writer thread.
+CHUNK_RECORDS = 2048
+
+BATCH_START = 0x80
+
+FINGER_DOWN = 0
+FINGER_MOTION = 1
+FINGER_UP = 2
+MOUSE_DOWN = 3
+MOUSE_MOTION = 4
+MOUSE_UP = 5
+
+EVENT_CODES = {
+    pygame.FINGERDOWN: FINGER_DOWN,
+    pygame.FINGERMOTION: FINGER_MOTION,
+    pygame.FINGERUP: FINGER_UP,
+    pygame.MOUSEBUTTONDOWN: MOUSE_DOWN,
+    pygame.MOUSEMOTION: MOUSE_MOTION,
+    pygame.MOUSEBUTTONUP: MOUSE_UP,
+}
+
+
+
+
+class InputRecorder:
+    """
+    Writes input events to a log file.  Records are packed into a preallocated chunk on
+    the calling thread, and full chunks are written out by a background thread so that
+    the main loop never waits on the disk.
+    """
+
+
+    def __init__(self, path, screen_size):
+        """
+        This is a cold path.
+        """
+
+        self.screen_w, self.screen_h = screen_size
+        self.start = time.perf_counter()
+        self.records = 0
+
+        self.__file = open(path, "wb")
+        self.__file.write(HEADER.pack(MAGIC, VERSION, self.screen_w, self.screen_h))
+
+        self.__chunk = bytearray(RECORD.size * CHUNK_RECORDS)
+        self.__used = 0
+
+        self.__chunks = queue.SimpleQueue()
+        self.__writer = threading.Thread(target=self.__write, name="MollyTime input recorder", daemon=True)
+        self.__writer.start()
+
+
+    def record(self, event, stamp, batch_start=False):
+        """
+        Records a touch or mouse event.  Other events, and mouse events synthesized from
+        touches, are ignored.  Arg `stamp` is the arrival time from `timing.event_time`.
+        Arg `batch_start` marks the first recorded event of a batch fetched by the main
+        loop, so keep passing it until this returns True.  Returns whether the event
+        was recorded.
+
+        This is a hot path.
+        """
+
+        encoded = encode_event(event, self.screen_w, self.screen_h)
+        if encoded is None:
+            return False
+
+        code, finger_id, x, y = encoded
+        if batch_start:
+            code |= BATCH_START
+
+        RECORD.pack_into(self.__chunk, self.__used, stamp - self.start, finger_id, x, y, code)
+        self.__used += RECORD.size
+        self.records += 1
+
+        if self.__used == len(self.__chunk):
+            self.__chunks.put(self.__chunk)
+            self.__chunk = bytearray(RECORD.size * CHUNK_RECORDS)
+            self.__used = 0
+
+        return True
+
+
+    def close(self):
+        """
+        Writes out everything still buffered and closes the log.
+
+        This is a cold path.
+        """
+        if self.__used:
+            self.__chunks.put(bytes(self.__chunk[:self.__used]))
+            self.__used = 0
+        self.__chunks.put(None)
+        self.__writer.join()
+        self.__file.close()
+
+
+    def __write(self):
+        while (chunk := self.__chunks.get()) is not None:
+            self.__file.write(chunk)
+        self.__file.flush()
+
+
+
+
+def encode_event(event, screen_w, screen_h):
+    """
+    Returns a `(code, finger_id, x, y)` tuple describing a touch or mouse event with
+    normalized coordinates, or None for other events, mouse events synthesized from
+    touches, and mouse motion with no button down.  For mouse buttons the finger id is
+    the button number.
+
+    This is a hot path.
+    """
+
+    code = EVENT_CODES.get(event.type)
+    if code is None:
+        return None
+
+    if code >= MOUSE_DOWN:
+        if event.touch:
+            return None
+        if code == MOUSE_MOTION:
+            if not any(event.buttons):
+                return None
+            finger_id = 0
+        else:
+            finger_id = event.button
+        x = event.pos[0] / max(screen_w - 1, 1)
+        y = event.pos[1] / max(screen_h - 1, 1)
+        return code, finger_id, x, y
+
+    return code, event.finger_id, event.x, event.y
+
+
+def decode_event(code, finger_id, x, y, screen_w, screen_h):
+    """
+    The inverse of `encode_event`.  Returns a pygame event.
+
+    This is a hot path.
+    """
+
+    if code <= FINGER_UP:
+        event_type = (pygame.FINGERDOWN, pygame.FINGERMOTION, pygame.FINGERUP)[code]
+        return pygame.event.Event(
+            event_type, touch_id=0, finger_id=finger_id, x=x, y=y, dx=0.0, dy=0.0, pressure=1.0)
+
+    pos = (round(x * (screen_w - 1)), round(y * (screen_h - 1)))
+    if code == MOUSE_MOTION:
+        return pygame.event.Event(
+            pygame.MOUSEMOTION, pos=pos, rel=(0, 0), buttons=(1, 0, 0), touch=False)
+
+    event_type = pygame.MOUSEBUTTONDOWN if code == MOUSE_DOWN else pygame.MOUSEBUTTONUP
+    return pygame.event.Event(event_type, pos=pos, button=finger_id, touch=False)
+
+
+def read_log(path):
+    """
+    Returns the recorded screen size and a list of batches, where each batch is a list of
+    `(time, event)` tuples with pygame events reconstructed for that screen size.
+
+    This is a cold path.
+    """
+
+    with open(path, "rb") as log:
+        data = log.read()
+
+    magic, version, screen_w, screen_h = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a MollyTime input log")
+
+    batches = []
+    for offset in range(HEADER.size, len(data) - RECORD.size + 1, RECORD.size):
+        stamp, finger_id, x, y, code = RECORD.unpack_from(data, offset)
+
+        if code & BATCH_START or not batches:
+            batches.append([])
+        code &= ~BATCH_START
+
+        event = decode_event(code, finger_id, x, y, screen_w, screen_h)
+        batches[-1].append((stamp, event))
+
+    return (screen_w, screen_h), batches
+
+
+def replay(path, play_surface, realtime=False, screen=None):
+    """
+    Feeds a recorded log through `play_surface` batch by batch, cranking after each
+    batch the same way `Instrument.__call__` does.  When `realtime` is set each batch is
+    held back until its recorded time, otherwise the log is replayed as fast as
+    possible.  If `screen` is given, the resulting blits are applied to it and the
+    display is updated.  The play surface should have the same screen size as the log.
+
+    Returns the number of events replayed.
+    """
+
+    screen_size, batches = read_log(path)
+    if screen_size != (play_surface.screen_w, play_surface.screen_h):
+        print(f"Warning: {path} was recorded on a {screen_size[0]}x{screen_size[1]} screen")
+
+    start = time.perf_counter()
+    count = 0
+
+    for batch in batches:
+        if realtime:
+            delay = batch[0][0] - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        for event in play_surface.coalesce_events([event for stamp, event in batch]):
+            play_surface.input_event(event)
+        count += len(batch)
+
+        update_rects, blit_sequence = play_surface.crank()
+        if screen is not None and blit_sequence:
+            screen.blits(blit_sequence=blit_sequence)
+            pygame.display.update(update_rects)
+
+    return count
+
+
+if __name__ == "__main__":
+    # Prints a summary of each log named on the command line.
+    for path in sys.argv[1:]:
+        (screen_w, screen_h), batches = read_log(path)
+        events = [event for batch in batches for stamp, event in batch]
+        duration = batches[-1][-1][0] if batches else 0.0
+        print(f"{path}: {screen_w}x{screen_h}, {len(events)} events in {len(batches)} batches over {duration:.2f} s")
+        for event_type in EVENT_CODES:
+            count = sum(1 for event in events if event.type == event_type)
+            if count:
+                print(f"  {pygame.event.event_name(event_type)}: {count}")
@@ -1,4 +1,6 @@
 
+import threading
+
 from alsa_midi import SequencerClient, WRITE_PORT, READ_PORT
 from alsa_midi import NoteOnEvent, NoteOffEvent, KeyPressureEvent, ControlChangeEvent
 from alsa_midi import ProgramChangeEvent, ChannelPressureEvent, PitchBendEvent
@@ -11,6 +13,40 @@ port = client.create_port(
     caps=READ_PORT,
     type=PortType.APPLICATION | PortType.SOFTWARE | PortType.MIDI_GENERIC)
 
+# Scheduled events are delivered by the sequencer from this queue.  One tick is one
+# MIDI clock pulse at the queue's tempo.
+QUEUE_PPQ = 24
+queue = client.create_queue("MollyTime")
+queue.set_tempo(bpm=120, ppq=QUEUE_PPQ)
+queue.start()
+client.drain_output()
+
+
+def queue_time():
+    """
+    Returns the current position of the scheduling queue as a `(real_time, tick)`
+    tuple, where `real_time` is in seconds since the queue started.  Add to these to
+    get the `real_time` and `tick` arguments of `schedule_message`.
+    """
+    status = queue.get_status()
+    return float(status.real_time), status.tick_time
+
+
+def set_queue_tempo(bpm):
+    """
+    Sets the tempo used to convert the queue's ticks to time.
+    """
+    queue.set_tempo(bpm=bpm, ppq=QUEUE_PPQ)
+    client.drain_output()
+
+
+# Incoming messages are read by a separate client, so the reader thread never shares
+# a sequencer handle with the thread sending output.  See `open_input`.
+input_client = None
+input_port = None
+_input_thread = None
+_input_running = False
+
 
 def note_on(note, velocity, channel=0):
     """
@@ -66,19 +102,20 @@ def channel_pressure(pressure, channel=0):
     client.event_output(event, port=port)
 
 
-def pitch_bend(bend, channel=0):
-    """
-    Arg `bend` is a float between -1.0 and 1.0 inclusive.
-    Arg 'channel' is an integer between 0 and 15 inclusive.
-    """
-
+def _bend_value(bend):
     if bend < 0:
         bend = 0x3FFF - max(-1, abs(bend)) * 0x1FFF
     elif bend > 0:
         bend = min(bend, 1) * 0x1FFF
+    return int(bend)
 
-    event = PitchBendEvent(channel, int(bend))
 
+def pitch_bend(bend, channel=0):
+    """
+    Arg `bend` is a float between -1.0 and 1.0 inclusive.
+    Arg 'channel' is an integer between 0 and 15 inclusive.
+    """
+    event = PitchBendEvent(channel, _bend_value(bend))
     client.event_output(event, port=port)
 
 
@@ -114,6 +151,35 @@ def rt_clock():
     client.event_output(event, port=port)
 
 
+# Builds the event each send function sends, from the same arguments plus the `tick`
+# and `time` of the queue position to deliver it at.
+_SCHEDULED_EVENTS = {
+    "note_on": lambda note, velocity, channel=0, **when: NoteOnEvent(note, channel, velocity, **when),
+    "note_off": lambda note, velocity=0, channel=0, **when: NoteOffEvent(note, channel, velocity, **when),
+    "polyphonic_pressure": lambda note, pressure, channel=0, **when: KeyPressureEvent(note, channel, pressure, **when),
+    "control_change": lambda controller_number, value, channel=0, **when: ControlChangeEvent(channel, controller_number, value, **when),
+    "program_change": lambda program_number, channel=0, **when: ProgramChangeEvent(channel, program_number, **when),
+    "channel_pressure": lambda pressure, channel=0, **when: ChannelPressureEvent(channel, pressure, **when),
+    "pitch_bend": lambda bend, channel=0, **when: PitchBendEvent(channel, _bend_value(bend), **when),
+    "rt_start": lambda **when: StartEvent(**when),
+    "rt_continue": lambda **when: ContinueEvent(**when),
+    "rt_stop": lambda **when: StopEvent(**when),
+    "rt_clock": lambda **when: ClockEvent(**when),
+}
+
+
+def schedule_message(message, *args, tick=None, real_time=None):
+    """
+    Schedules a message on the queue instead of sending it right away.  Arg `message`
+    names one of the send functions, such as "note_on", and `args` are its arguments.
+    Exactly one of `tick` and `real_time` gives the queue position to deliver it at,
+    see `queue_time`.  Like the send functions, this takes effect on `flush`.
+    """
+    assert (tick is None) != (real_time is None)
+    event = _SCHEDULED_EVENTS[message](*args, tick=tick, time=real_time)
+    client.event_output(event, queue=queue, port=port)
+
+
 def flush():
     """
     Flushes all pending output messages.
@@ -148,14 +214,84 @@ def device_names():
     return [d.client_name for d in client.list_ports(output=True)]
 
 
+def _connect_input(target):
+    """
+    Subscribes the input port to the device called `target`, if it sends MIDI.
+    """
+    for device in client.list_ports(input=True):
+        if device.client_name == target or device.name == target:
+            input_port.connect_from(device)
+            return
+
+
 def auto_connect_inner(device_priority):
     for target in device_priority:
         for device in client.list_ports(output=True):
             if device.client_name == target:
                 port.connect_to(device)
+                if input_port is not None:
+                    _connect_input(target)
                 return device.client_name
 
             elif device.name == target:
                 port.connect_to(device)
+                if input_port is not None:
+                    _connect_input(target)
                 return device.name
     return None
+
+
+def _read_input(push):
+    """
+    The body of the input reader thread.  Blocks on the sequencer for at most a
+    quarter of a second at a time so that `close_input` can stop it.
+    """
+    while _input_running:
+        event = input_client.event_input(prefer_bytes=True, timeout=.25)
+        if isinstance(event, MidiBytesEvent):
+            push(bytes(event.midi_bytes))
+
+
+def open_input(push):
+    """
+    Creates a MIDI input port and starts a thread which calls `push` with the bytes of
+    every message that arrives on it.  Call this before `auto_connect` to also
+    subscribe to the device it connects to.
+    """
+    global input_client
+    global input_port
+    global _input_thread
+    global _input_running
+
+    if _input_thread is not None:
+        return
+
+    input_client = SequencerClient("MollyTime input")
+    input_port = input_client.create_port(
+        "input",
+        caps=WRITE_PORT,
+        type=PortType.APPLICATION | PortType.SOFTWARE | PortType.MIDI_GENERIC)
+
+    _input_running = True
+    _input_thread = threading.Thread(target=_read_input, args=(push,), name="MollyTime MIDI input", daemon=True)
+    _input_thread.start()
+
+
+def close_input():
+    """
+    Stops the input reader thread and removes the input port.
+    """
+    global input_client
+    global input_port
+    global _input_thread
+    global _input_running
+
+    if _input_thread is None:
+        return
+
+    _input_running = False
+    _input_thread.join()
+    _input_thread = None
+    input_client.close()
+    input_client = None
+    input_port = None
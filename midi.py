@@ -4,13 +4,56 @@ import time
 import platform
 operating_system = platform.system()
 
-if operating_system == "Linux":
+if os.environ.get("MOLLYTIME_MIDI") == "null":
+    from null_midi import *
+
+elif operating_system == "Linux":
     from linux_midi import *
 
 else:
     from generic_midi import *
 
 import xml.etree.ElementTree as etree
+from types import SimpleNamespace
+
+from midi_thread import OutputThread, LockedOutput
+from midi_shaper import TrafficShaper
+from midi_mpe import MPEZone
+from midi_input import InputQueue
+from midi_recorder import MidiRecorder
+
+
+# The names of the functions every backend provides for sending MIDI messages.  Output
+# stages wrap these, and `install_output` swaps them out at the module level.
+SEND_FUNCTIONS = (
+    "note_on",
+    "note_off",
+    "polyphonic_pressure",
+    "control_change",
+    "program_change",
+    "channel_pressure",
+    "pitch_bend",
+    "rt_start",
+    "rt_continue",
+    "rt_stop",
+    "rt_clock",
+    "flush")
+
+
+# The running OutputThread, if any.
+output_thread = None
+
+# The installed TrafficShaper, if any.
+shaper = None
+
+# The InputQueue receiving incoming messages, if any.
+input_queue = None
+
+# The installed MidiRecorder, if any.
+recorder = None
+
+# The installed LockedOutput, if any.
+locked_output = None
 
 
 octave_labels = (
@@ -34,6 +77,184 @@ def simple_note_name(note, tie=0):
     return f"{octave_labels[index][tie]}{octave - 1}"
 
 
+def current_output():
+    """
+    Returns a namespace holding the send functions that are currently in use.  This is
+    what an output stage should wrap.
+    """
+    return SimpleNamespace(**{name: globals()[name] for name in SEND_FUNCTIONS})
+
+
+def install_output(output):
+    """
+    Replaces this module's send functions with the ones provided by `output`, which may
+    be any object with the functions named in SEND_FUNCTIONS.  Tiles call these through
+    the module (eg `midi.note_on`), so they pick up the change immediately.
+    """
+    for name in SEND_FUNCTIONS:
+        globals()[name] = getattr(output, name)
+
+
+def start_output_thread(capacity=4096):
+    """
+    Routes all MIDI output through a dedicated sender thread.  The send functions then
+    only enqueue messages, and `flush` wakes the sender thread.
+    """
+    global output_thread
+    if output_thread is None:
+        output_thread = OutputThread(current_output(), capacity)
+        output_thread.start()
+        install_output(output_thread)
+    return output_thread
+
+
+def stop_output_thread():
+    """
+    Sends everything still queued and goes back to sending messages directly.
+    """
+    global output_thread
+    if output_thread is not None:
+        install_output(output_thread.output)
+        output_thread.stop()
+        output_thread = None
+
+
+def start_shaper(min_interval=0.0):
+    """
+    Routes all MIDI output through a TrafficShaper, which drops continuous messages
+    that repeat the last value sent and optionally caps how often each destination is
+    sent to.  Values held back by the cap are sent by `poll`.  When the output thread
+    is also used, start it first so that the shaper sits in front of it.
+    """
+    global shaper
+    if shaper is None:
+        shaper = TrafficShaper(current_output(), min_interval)
+        install_output(shaper)
+    return shaper
+
+
+def stop_shaper():
+    """
+    Sends any values the shaper is holding back and goes back to sending messages
+    directly.
+    """
+    global shaper
+    if shaper is not None:
+        shaper.release_all()
+        install_output(shaper.output)
+        shaper = None
+
+
+def poll():
+    """
+    Gives output stages that hold messages back a chance to send them.  Returns the
+    time in seconds until it next needs to be called, or None if it does not.
+
+    This is a hot path.
+    """
+    if shaper is not None:
+        if locked_output is not None:
+            with locked_output.lock:
+                return shaper.poll()
+        return shaper.poll()
+    return None
+
+
+def schedule(message, *args, tick=None, real_time=None):
+    """
+    Schedules a message to be delivered by the backend at a future position of its
+    queue, see `queue_time`.  Arg `message` names one of the send functions, such as
+    "note_on", and `args` are its arguments.  Exactly one of `tick` and `real_time`
+    gives the position.  The message goes to the backend at the next `flush`.
+
+    Scheduled messages go straight to the backend, past every output stage, so they
+    are neither shaped nor recorded.  Only the ALSA backend supports this.  Holds the
+    output lock if there is one, but cannot be used while the output thread runs,
+    since that sends to the backend from its own thread.
+    """
+    if output_thread is not None:
+        raise RuntimeError("Messages cannot be scheduled while the output thread is running")
+    if locked_output is not None:
+        with locked_output.lock:
+            schedule_message(message, *args, tick=tick, real_time=real_time)
+    else:
+        schedule_message(message, *args, tick=tick, real_time=real_time)
+
+
+def start_locking():
+    """
+    Serializes all MIDI output with a lock, see LockedOutput.  Every other output stage
+    and backend is only safe to call from a single thread, so this must be in place
+    before MIDI is sent from a second thread, such as by a ClockEngine.  Start it after
+    every other output stage so that it sits in front of them all, and stop it before
+    them.
+    """
+    global locked_output
+    if locked_output is None:
+        locked_output = LockedOutput(current_output())
+        install_output(locked_output)
+    return locked_output
+
+
+def stop_locking():
+    """
+    Goes back to sending messages without the lock.  Only do this once every thread but
+    one has stopped sending.
+    """
+    global locked_output
+    if locked_output is not None:
+        install_output(locked_output.output)
+        locked_output = None
+
+
+def start_recorder(path):
+    """
+    Records all MIDI output to a Standard MIDI File at `path`, see `midi_recorder`.
+    Start the recorder after the output thread and before the shaper, so that it
+    records what is actually sent.
+    """
+    global recorder
+    if recorder is None:
+        recorder = MidiRecorder(current_output(), path)
+        install_output(recorder)
+    return recorder
+
+
+def stop_recorder():
+    """
+    Finishes the recording and goes back to sending messages directly.
+    """
+    global recorder
+    if recorder is not None:
+        install_output(recorder.output)
+        recorder.close()
+        recorder = None
+
+
+def start_input(notify=None):
+    """
+    Starts receiving MIDI into `input_queue`, an InputQueue which the main loop drains.
+    Arg `notify` is called from the backend's reader thread when new messages are
+    waiting, and may also be set later on the queue.  Start input before connecting to
+    also receive from the connected device.
+    """
+    global input_queue
+    if input_queue is None:
+        input_queue = InputQueue(notify)
+        open_input(input_queue.push)
+    return input_queue
+
+
+def stop_input():
+    """
+    Stops receiving MIDI.
+    """
+    global input_queue
+    if input_queue is not None:
+        close_input()
+        input_queue = None
+
+
 def auto_connect():
     settings_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "settings.xml")
     tree = etree.parse(settings_path)
@@ -52,9 +273,39 @@ def auto_connect():
     return auto_connect_inner(device_priority)
 
 
-def run(main_thunk):
+def run(main_thunk, threaded_output=False, shaped_output=False, min_interval=0.0, receive_input=False, record_path=None):
+    """
+    Connects to a MIDI device and calls `main_thunk`.  Set `threaded_output` to send
+    from a dedicated thread, see `start_output_thread`, `shaped_output` to thin out
+    continuous messages, see `start_shaper`, `receive_input` to also receive MIDI, see
+    `start_input`, and `record_path` to record the output to a MIDI file, see
+    `start_recorder`.
+    """
     #print_verbose_device_info()
+    if receive_input:
+        start_input()
+
     if connection := auto_connect():
         print(f"Connected to {connection}")
 
-    main_thunk()
+    if threaded_output:
+        start_output_thread()
+
+    if record_path:
+        start_recorder(record_path)
+
+    if shaped_output:
+        start_shaper(min_interval)
+
+    try:
+        main_thunk()
+    finally:
+        if shaper is not None:
+            print(f"MIDI shaper: {shaper.delivered} delivered, {shaper.suppressed} suppressed")
+        stop_shaper()
+        midi_file = recorder
+        stop_recorder()
+        if midi_file is not None:
+            print(f"Recorded {midi_file.messages} MIDI messages to {midi_file.path}")
+        stop_output_thread()
+        stop_input()
@@ -0,0 +1,178 @@
+import time
+import threading
+
+import midi
+from timing import RollingStats
+
+
+# How long before a deadline the clock thread stops sleeping and starts spinning.
+SPIN_MARGIN = .001
+
+
+
+
+class ClockEngine:
+    """
+    Generates MIDI clock on its own thread.  Each pulse is scheduled against an absolute
+    deadline on the monotonic clock, so time spent sending and oversleeping does not
+    accumulate into tempo drift.  Tempo changes take effect on the next pulse.
+
+    Transport messages requested with `start`, `stop`, and `resume` are sent by the
+    clock thread right before the next pulse, so that all messages from the engine go
+    out from the same thread in order.
+
+    The output stages and backends are only safe to call from a single thread, so while
+    the clock thread runs, all MIDI output goes through `midi.start_locking`, and the
+    main loop's messages and the clock's are sent one at a time.  Launch the engine
+    after any other output stage has been started, and close it before they are
+    stopped.
+
+    The timing error of every pulse is recorded in `jitter`, which can be queried while
+    the engine is running.
+    """
+
+
+    def __init__(self, bpm=120, ppqn=24, callback=None):
+        """
+        Arg `bpm` is the initial tempo in beats per minute.
+        Arg `ppqn` is the number of clock pulses per quarter note, which is 24 for MIDI.
+        Arg `callback` is optional, and is called from the clock thread after every pulse
+        with the pulse count since the engine was launched.  It may send MIDI.
+
+        This is a cold path.
+        """
+
+        self.ppqn = ppqn
+        self.callback = callback
+        self.interval = 60 / (abs(bpm) * ppqn)
+
+        # Distance in seconds between each pulse and its deadline.
+        self.jitter = RollingStats()
+
+        self.pulses = 0
+        self.playing = False
+
+        self.__transport = []
+        self.__locking = False
+        self.__running = False
+        self.__thread = None
+        self.__wake = threading.Event()
+
+
+    @property
+    def bpm(self):
+        return 60 / (self.interval * self.ppqn)
+
+
+    @bpm.setter
+    def bpm(self, bpm):
+        self.interval = 60 / (abs(bpm) * self.ppqn)
+
+
+    def launch(self):
+        """
+        Starts sending clock pulses without changing the transport state.
+
+        This is a cold path.
+        """
+        if self.__thread is None:
+            if midi.locked_output is None:
+                midi.start_locking()
+                self.__locking = True
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__run, name="MollyTime MIDI clock", daemon=True)
+            self.__thread.start()
+
+
+    def close(self):
+        """
+        Stops sending clock pulses and waits for the clock thread to finish.
+
+        This is a cold path.
+        """
+        if self.__thread is not None:
+            self.__running = False
+            self.__wake.set()
+            self.__thread.join()
+            self.__thread = None
+            if self.__locking:
+                midi.stop_locking()
+                self.__locking = False
+
+
+    def start(self):
+        """
+        Sends "start" before the next pulse, launching the engine if needed.
+        """
+        self.__transport.append("rt_start")
+        self.playing = True
+        self.launch()
+
+
+    def stop(self):
+        """
+        Sends "stop" before the next pulse.  Clock pulses keep going while stopped.
+        """
+        self.__transport.append("rt_stop")
+        self.playing = False
+
+
+    def resume(self):
+        """
+        Sends "continue" before the next pulse.
+        """
+        self.__transport.append("rt_continue")
+        self.playing = True
+        self.launch()
+
+
+    def stats(self):
+        """
+        Returns the mean, 99th percentile, and maximum pulse timing error in seconds.
+        """
+        return self.jitter.summary()
+
+
+    def __wait_until(self, deadline):
+        """
+        Sleeps until shortly before the deadline and spins for the rest, which is much
+        more accurate than sleeping the whole way.  The spin yields so that it does not
+        hold the GIL away from the main loop.
+        """
+        remaining = deadline - time.perf_counter() - SPIN_MARGIN
+        if remaining > 0:
+            self.__wake.wait(remaining)
+        while time.perf_counter() < deadline and self.__running:
+            time.sleep(0)
+
+
+    def __run(self):
+        deadline = time.perf_counter()
+
+        while self.__running:
+            self.__wait_until(deadline)
+            if not self.__running:
+                break
+
+            while self.__transport:
+                getattr(midi, self.__transport.pop(0))()
+
+            self.jitter.add(time.perf_counter() - deadline)
+            midi.rt_clock()
+            midi.flush()
+
+            self.pulses += 1
+            if self.callback:
+                self.callback(self.pulses - 1)
+
+            deadline += self.interval
+
+            # If the thread fell more than a pulse behind, skip ahead instead of
+            # sending a burst of late pulses.
+            now = time.perf_counter()
+            if now > deadline + self.interval:
+                deadline = now
+
+        while self.__transport:
+            getattr(midi, self.__transport.pop(0))()
+        midi.flush()
@@ -0,0 +1,95 @@
+import time
+from collections import deque
+
+
+# Status bytes of the incoming messages MollyTime reacts to.
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+# The most messages `InputQueue.drain` hands out per call, so that a burst of input,
+# such as a SysEx dump, is spread over several iterations of the main loop instead of
+# stalling rendering.
+DRAIN_LIMIT = 256
+
+
+
+
+class InputQueue:
+    """
+    Carries incoming MIDI messages from a backend's reader thread to the main loop.  The
+    reader thread calls `push` with the raw bytes of each message, and the main loop
+    calls `drain` once per iteration.  Appending to and popping from a deque are atomic,
+    so neither side takes a lock, and nothing is ever dropped.
+
+    So that the main loop does not have to poll while it is idle, `push` calls the
+    `notify` callback when the queue stops being empty.  The Instrument uses this to
+    post a pygame event, which wakes its blocking wait on the event queue.
+    """
+
+
+    def __init__(self, notify=None):
+        """
+        Arg `notify` is called without arguments from the reader thread when new
+        messages are waiting.
+
+        This is a cold path.
+        """
+
+        self.notify = notify
+
+        # `(arrival time, message bytes)` tuples, oldest first.
+        self.__messages = deque()
+
+        # Set from when `notify` is called until the main loop drains the queue, so a
+        # burst of messages only wakes the main loop once.
+        self.__notified = False
+
+        # Messages pushed in total, and the most that were waiting at once.
+        self.received = 0
+        self.peak = 0
+
+
+    def __len__(self):
+        return len(self.__messages)
+
+
+    def push(self, message):
+        """
+        Adds a message.  Called by the backend's reader thread.
+
+        This is a hot path.
+        """
+        messages = self.__messages
+        messages.append((time.perf_counter(), message))
+        self.received += 1
+        if len(messages) > self.peak:
+            self.peak = len(messages)
+        if not self.__notified:
+            self.__notified = True
+            if self.notify:
+                self.notify()
+
+
+    def drain(self, limit=DRAIN_LIMIT):
+        """
+        Yields up to `limit` waiting messages as `(arrival time, message bytes)` tuples,
+        oldest first.  If more are left over, `notify` is called again so the main loop
+        comes back for them.  Called by the main loop on every iteration, even when the
+        queue is empty, since draining is also what rearms `notify`.
+
+        This is a hot path.
+        """
+
+        # Cleared before popping, so a message pushed from here on notifies again.
+        self.__notified = False
+
+        messages = self.__messages
+        for index in range(limit):
+            if not messages:
+                return
+            yield messages.popleft()
+
+        if messages and not self.__notified:
+            self.__notified = True
+            if self.notify:
+                self.notify()
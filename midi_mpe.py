@@ -0,0 +1,126 @@
+"""
+Channel allocation for MIDI Polyphonic Expression.
+
+An MPE zone is a manager channel plus a range of member channels.  Every sounding note
+gets a member channel to itself, so pitch bend and channel pressure on that channel
+only affect that one note.  See the MPE specification from the MIDI Association.
+"""
+
+
+# The default pitch bend range of MPE member channels in semitones.
+MEMBER_BEND_RANGE = 48
+
+
+
+
+class MPEZone:
+    """
+    Hands out the member channels of an MPE zone to the notes being played.  A freed
+    channel goes to the back of the line, so a released note's tail is left alone for
+    as long as possible.  When every member channel is taken, the channel of the oldest
+    sounding note is stolen, and its owner is told so it can stop the note.
+
+    Channels are kept in preallocated lists, so holding and releasing notes does not
+    allocate.
+    """
+
+
+    def __init__(self, members=15, upper=False, bend_range=MEMBER_BEND_RANGE):
+        """
+        Arg `members` is the number of member channels, from 1 to 15.
+        Arg `upper` selects the upper zone, which is managed on channel 15 and counts
+        its member channels down from 14, instead of the lower zone, which is managed
+        on channel 0 and counts up from 1.  Channels are numbered from 0.
+        Arg `bend_range` is the pitch bend range of the member channels in semitones.
+
+        This is a cold path.
+        """
+
+        assert(1 <= members <= 15)
+
+        self.upper = upper
+        self.bend_range = bend_range
+
+        if upper:
+            self.manager = 15
+            self.members = tuple(range(14, 14 - members, -1))
+        else:
+            self.manager = 0
+            self.members = tuple(range(1, 1 + members))
+
+        # Free channels, least recently released first, and taken channels, oldest
+        # first.  Between them these always hold every member channel.
+        self.__free = list(self.members)
+        self.__taken = []
+
+        # The owner of each taken channel, indexed by channel.
+        self.__owners = [None] * 16
+
+        # The number of times a channel was stolen from a sounding note.
+        self.steals = 0
+
+        # Set once `configure` has been sent.
+        self.configured = False
+
+
+    @property
+    def active(self):
+        """
+        The number of member channels currently taken.
+        """
+        return len(self.__taken)
+
+
+    def configure(self, output):
+        """
+        Sends the MPE configuration message for this zone, followed by the pitch bend
+        range of each member channel.  Arg `output` is anything with a `control_change`
+        function, such as the midi module.
+
+        This is a cold path.
+        """
+
+        def rpn(channel, number, value):
+            output.control_change(101, 0, channel)
+            output.control_change(100, number, channel)
+            output.control_change(6, value, channel)
+            output.control_change(38, 0, channel)
+            output.control_change(101, 127, channel)
+            output.control_change(100, 127, channel)
+
+        rpn(self.manager, 6, len(self.members))
+        for channel in self.members:
+            rpn(channel, 0, self.bend_range)
+        self.configured = True
+
+
+    def acquire(self, owner):
+        """
+        Returns a member channel for a new note and records `owner` as its owner.  If
+        every channel is taken, the oldest note's channel is stolen and its owner's
+        `stolen` method is called with the channel before this returns.
+
+        This is a hot path.
+        """
+        if self.__free:
+            channel = self.__free.pop(0)
+        else:
+            channel = self.__taken.pop(0)
+            self.steals += 1
+            self.__owners[channel].stolen(channel)
+        self.__taken.append(channel)
+        self.__owners[channel] = owner
+        return channel
+
+
+    def release(self, channel, owner):
+        """
+        Gives back a channel once `owner` has ended its note.  Channels that have since
+        been stolen by someone else are left alone.
+
+        This is a hot path.
+        """
+        if self.__owners[channel] is owner:
+            self.__owners[channel] = None
+            self.__taken.remove(channel)
+            self.__free.append(channel)
@@ -0,0 +1,224 @@
+"""
+Records the MIDI a session sends to a Standard MIDI File.
+
+The recorder is an output stage, see `midi.install_output`.  Each send function passes
+the message on and appends it with a timestamp to the current batch, and `flush` hands
+the batch to a writer thread through a bounded queue.  The writer appends the batch to
+a single track, type 0 file, and then rewrites the End of Track event and the track
+length, so the file on disk is complete after every batch even if the session ends
+abruptly.  Memory use does not grow with the length of the session.
+
+System realtime messages are passed on but not recorded.
+"""
+
+import time
+import queue
+import struct
+import threading
+
+from midi_shaper import bend_value
+
+
+# Ticks per quarter note, at the file's fixed tempo of 120 BPM.
+DIVISION = 960
+TEMPO = 500000
+TICKS_PER_SECOND = DIVISION * 1000000 / TEMPO
+
+HEADER = struct.Struct(">4sIHHH")
+CHUNK = struct.Struct(">4sI")
+
+# Set Tempo, and End of Track.
+TEMPO_EVENT = b"\x00\xff\x51\x03" + TEMPO.to_bytes(3, "big")
+END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+# The most batches that may wait for the writer before `flush` blocks.
+QUEUE_BATCHES = 256
+
+
+
+
+def variable_length(value):
+    """
+    Encodes a non-negative integer as a MIDI variable length quantity.
+    """
+    encoded = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        encoded.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(encoded)
+
+
+
+
+class MidiRecorder:
+    """
+    An output stage that records every channel message sent through it to a Standard
+    MIDI File, see the module documentation.  Like OutputThread, this is only safe to
+    call from a single thread.
+    """
+
+
+    def __init__(self, output, path):
+        """
+        Arg `output` is any object providing the functions in `midi.SEND_FUNCTIONS`,
+        usually the result of `midi.current_output()`.
+        Arg `path` is the file to record to.  It is overwritten.
+
+        This is a cold path.
+        """
+
+        self.output = output
+        self.path = path
+        self.start = time.perf_counter()
+
+        # Messages recorded, and the number of times `flush` had to wait for the writer.
+        self.messages = 0
+        self.overruns = 0
+
+        # `(time, status, data 1, data 2)` tuples since the last flush.
+        self.__batch = []
+        self.__batches = queue.Queue(QUEUE_BATCHES)
+
+        self.__file = open(path, "wb")
+        self.__file.write(HEADER.pack(b"MThd", 6, 0, 1, DIVISION))
+        self.__track_start = self.__file.tell()
+        self.__file.write(CHUNK.pack(b"MTrk", 0))
+        self.__file.write(TEMPO_EVENT)
+        self.__track_end = self.__file.tell()
+        self.__last_tick = 0
+        self.__seal()
+
+        self.__thread = threading.Thread(target=self.__run, name="MollyTime MIDI recorder", daemon=True)
+        self.__thread.start()
+
+
+    def __seal(self):
+        """
+        Writes the End of Track event after the last event, updates the track length to
+        match, and pushes it all to the operating system.
+        """
+        recording = self.__file
+        recording.seek(self.__track_end)
+        recording.write(END_OF_TRACK)
+        length = recording.tell() - self.__track_start - CHUNK.size
+        recording.seek(self.__track_start)
+        recording.write(CHUNK.pack(b"MTrk", length))
+        recording.flush()
+
+
+    def __run(self):
+        recording = self.__file
+        start = self.start
+
+        while True:
+            batch = self.__batches.get()
+            if batch is None:
+                break
+
+            events = bytearray()
+            last_tick = self.__last_tick
+            for stamp, status, data_1, data_2 in batch:
+                tick = max(round((stamp - start) * TICKS_PER_SECOND), last_tick)
+                events += variable_length(tick - last_tick)
+                last_tick = tick
+                if status & 0xE0 == 0xC0:
+                    events += bytes((status, data_1))
+                else:
+                    events += bytes((status, data_1, data_2))
+            self.__last_tick = last_tick
+
+            recording.seek(self.__track_end)
+            recording.write(events)
+            self.__track_end = recording.tell()
+            self.__seal()
+
+
+    def __record(self, status, data_1, data_2=0):
+        """
+        This is a hot path.
+        """
+        self.__batch.append((time.perf_counter(), status, int(data_1) & 0x7F, int(data_2) & 0x7F))
+
+
+    def close(self):
+        """
+        Writes out everything recorded and closes the file.
+
+        This is a cold path.
+        """
+        if self.__thread is not None:
+            self.flush()
+            self.__batches.put(None)
+            self.__thread.join()
+            self.__thread = None
+            self.__file.close()
+
+
+    def note_on(self, note, velocity, channel=0):
+        self.output.note_on(note, velocity, channel)
+        self.__record(0x90 | 0xF & channel, note, velocity)
+
+
+    def note_off(self, note, velocity=0, channel=0):
+        self.output.note_off(note, velocity, channel)
+        self.__record(0x80 | 0xF & channel, note, velocity)
+
+
+    def polyphonic_pressure(self, note, pressure, channel=0):
+        self.output.polyphonic_pressure(note, pressure, channel)
+        self.__record(0xA0 | 0xF & channel, note, pressure)
+
+
+    def control_change(self, controller_number, value, channel=0):
+        self.output.control_change(controller_number, value, channel)
+        self.__record(0xB0 | 0xF & channel, controller_number, value)
+
+
+    def program_change(self, program_number, channel=0):
+        self.output.program_change(program_number, channel)
+        self.__record(0xC0 | 0xF & channel, program_number)
+
+
+    def channel_pressure(self, pressure, channel=0):
+        self.output.channel_pressure(pressure, channel)
+        self.__record(0xD0 | 0xF & channel, pressure)
+
+
+    def pitch_bend(self, bend, channel=0):
+        self.output.pitch_bend(bend, channel)
+        bend = bend_value(bend)
+        self.__record(0xE0 | 0xF & channel, bend, bend >> 7)
+
+
+    def rt_start(self):
+        self.output.rt_start()
+
+
+    def rt_continue(self):
+        self.output.rt_continue()
+
+
+    def rt_stop(self):
+        self.output.rt_stop()
+
+
+    def rt_clock(self):
+        self.output.rt_clock()
+
+
+    def flush(self):
+        """
+        Flushes the wrapped output and hands the messages recorded since the last flush
+        to the writer thread.
+        """
+        self.output.flush()
+        batch = self.__batch
+        if batch:
+            self.messages += len(batch)
+            self.__batch = []
+            try:
+                self.__batches.put_nowait(batch)
+            except queue.Full:
+                self.overruns += 1
+                self.__batches.put(batch)
@@ -0,0 +1,341 @@
+import math
+import time
+from array import array
+
+
+# Each destination of a continuous message has one slot: polyphonic pressure per
+# channel and note, control change per channel and controller, and channel pressure and
+# pitch bend per channel.
+POLYPHONIC_PRESSURE = 0
+CONTROL_CHANGE = 16 * 128
+CHANNEL_PRESSURE = 2 * 16 * 128
+PITCH_BEND = CHANNEL_PRESSURE + 16
+SLOTS = PITCH_BEND + 16
+
+# Control changes from this controller number on are channel mode messages, such as
+# all notes off, which are never shaped.
+CHANNEL_MODE = 120
+
+
+
+
+def bend_value(bend):
+    """
+    Returns the 14 bit value a pitch bend amount between -1.0 and 1.0 is sent as.
+    """
+    bend = max(-1, min(bend, 1))
+    if bend < 0:
+        return 0x2000 + int(bend * 0x2000)
+    return 0x2000 + int(bend * 0x1FFF)
+
+
+
+
+class TrafficShaper:
+    """
+    An output stage that thins out continuous MIDI messages: polyphonic pressure,
+    control change, channel pressure, and pitch bend.  The last value sent to each
+    destination is remembered, and a message that repeats it is dropped.
+
+    Optionally each destination may also be sent at most once per `min_interval`.  A
+    value that arrives sooner is held back, replacing any value already held back for
+    the same destination, and is sent by `poll` once the interval is up, so the final
+    value always arrives.  Held back values on a channel are sent before any other
+    message on that channel passes through, so per channel ordering is preserved.
+
+    Note on and note off forget the polyphonic pressure sent to their note, so the
+    first pressure of the next note is always sent.  Like OutputThread, this is only
+    safe to call from a single thread.
+    """
+
+
+    def __init__(self, output, min_interval=0.0):
+        """
+        Arg `output` is any object providing the functions in `midi.SEND_FUNCTIONS`,
+        usually the result of `midi.current_output()`.
+        Arg `min_interval` is the shortest time in seconds between two messages to the
+        same destination, or 0 to only drop repeated values.
+
+        This is a cold path.
+        """
+
+        self.output = output
+        self.min_interval = float(min_interval)
+
+        # The value last sent to each slot, or NaN if it is unknown.  Pitch bend is
+        # compared by the 14 bit value it is sent as.
+        self.__sent = array("d", [math.nan]) * SLOTS
+
+        # When each slot was last sent to.
+        self.__sent_time = array("d", bytes(8 * SLOTS))
+
+        # The value held back for each slot, or NaN.  Slots with a held back value are
+        # listed in `__waiting`, in the order they were first held back, and counted
+        # per channel in `__channel_waiting`.
+        self.__held = array("d", [math.nan]) * SLOTS
+        self.__waiting = []
+        self.__channel_waiting = array("i", bytes(4 * 16))
+
+        channels = bytearray(SLOTS)
+        for slot in range(CHANNEL_PRESSURE):
+            channels[slot] = (slot >> 7) & 0xF
+        for slot in range(CHANNEL_PRESSURE, SLOTS):
+            channels[slot] = slot & 0xF
+        self.__channels = bytes(channels)
+
+        # Messages passed on to the wrapped output, and continuous messages dropped
+        # because they repeated the last value or were replaced while held back.
+        self.delivered = 0
+        self.suppressed = 0
+
+
+    @property
+    def pending(self):
+        """
+        The number of values currently held back.
+        """
+        return sum(self.__channel_waiting)
+
+
+    def stats(self):
+        """
+        Returns a dict of the shaper's counters.
+        """
+        return {
+            "delivered": self.delivered,
+            "suppressed": self.suppressed,
+            "pending": self.pending,
+        }
+
+
+    def __send(self, slot, value):
+        """
+        This is a hot path.
+        """
+        output = self.output
+        channel = self.__channels[slot]
+        if slot < CONTROL_CHANGE:
+            output.polyphonic_pressure(slot & 0x7F, int(value), channel)
+        elif slot < CHANNEL_PRESSURE:
+            output.control_change(slot & 0x7F, int(value), channel)
+        elif slot < PITCH_BEND:
+            output.channel_pressure(int(value), channel)
+        else:
+            output.pitch_bend(value, channel)
+        self.delivered += 1
+
+
+    def __shape(self, slot, value, compared):
+        """
+        Arg `value` is what would be sent, and `compared` is the value it is compared
+        by.
+
+        This is a hot path.
+        """
+
+        held = self.__held
+        if compared == self.__sent[slot]:
+            self.suppressed += 1
+            if held[slot] == held[slot]:
+                # A held back value was replaced by the one already sent.
+                held[slot] = math.nan
+                self.suppressed += 1
+                self.__channel_waiting[self.__channels[slot]] -= 1
+            return
+
+        min_interval = self.min_interval
+        if min_interval:
+            now = time.perf_counter()
+            if now - self.__sent_time[slot] < min_interval:
+                if held[slot] == held[slot]:
+                    self.suppressed += 1
+                else:
+                    self.__waiting.append(slot)
+                    self.__channel_waiting[self.__channels[slot]] += 1
+                held[slot] = value
+                return
+            self.__sent_time[slot] = now
+
+        if held[slot] == held[slot]:
+            held[slot] = math.nan
+            self.suppressed += 1
+            self.__channel_waiting[self.__channels[slot]] -= 1
+
+        self.__sent[slot] = compared
+        self.__send(slot, value)
+
+
+    def __release(self, slot, now):
+        """
+        Sends the value held back for a slot.
+
+        This is a hot path.
+        """
+        held = self.__held
+        value = held[slot]
+        held[slot] = math.nan
+        self.__channel_waiting[self.__channels[slot]] -= 1
+        self.__sent[slot] = bend_value(value) if slot >= PITCH_BEND else int(value)
+        self.__sent_time[slot] = now
+        self.__send(slot, value)
+
+
+    def __release_channel(self, channel):
+        """
+        Sends everything held back on a channel, ahead of another message on it.
+
+        This is a hot path.
+        """
+        if not self.__channel_waiting[channel]:
+            return
+
+        now = time.perf_counter()
+        held = self.__held
+        channels = self.__channels
+        waiting = self.__waiting
+        kept = 0
+        for slot in waiting:
+            if held[slot] != held[slot]:
+                continue
+            if channels[slot] == channel:
+                self.__release(slot, now)
+            else:
+                waiting[kept] = slot
+                kept += 1
+        del waiting[kept:]
+
+
+    def __forget_channel(self, channel):
+        """
+        Forgets every value sent on a channel.
+
+        This is a cold path.
+        """
+        sent = self.__sent
+        channels = self.__channels
+        for slot in range(SLOTS):
+            if channels[slot] == channel:
+                sent[slot] = math.nan
+
+
+    def poll(self):
+        """
+        Sends the held back values whose interval is up.  Returns the time in seconds
+        until the next held back value is due, or None if nothing is held back.  This is
+        meant to be called once per iteration of the main loop.
+
+        This is a hot path.
+        """
+
+        waiting = self.__waiting
+        if not waiting:
+            return None
+
+        now = time.perf_counter()
+        min_interval = self.min_interval
+        held = self.__held
+        sent_time = self.__sent_time
+        released = False
+        next_due = None
+        kept = 0
+        for slot in waiting:
+            if held[slot] != held[slot]:
+                continue
+            due = sent_time[slot] + min_interval - now
+            if due <= 0:
+                self.__release(slot, now)
+                released = True
+            else:
+                waiting[kept] = slot
+                kept += 1
+                if next_due is None or due < next_due:
+                    next_due = due
+        del waiting[kept:]
+
+        if released:
+            self.output.flush()
+        return next_due
+
+
+    def release_all(self):
+        """
+        Sends everything held back right away.
+
+        This is a cold path.
+        """
+        for channel in range(16):
+            self.__release_channel(channel)
+        self.__waiting.clear()
+        self.output.flush()
+
+
+    def note_on(self, note, velocity, channel=0):
+        self.__release_channel(channel)
+        self.__sent[POLYPHONIC_PRESSURE + (channel << 7) + int(note)] = math.nan
+        self.output.note_on(note, velocity, channel)
+        self.delivered += 1
+
+
+    def note_off(self, note, velocity=0, channel=0):
+        self.__release_channel(channel)
+        self.__sent[POLYPHONIC_PRESSURE + (channel << 7) + int(note)] = math.nan
+        self.output.note_off(note, velocity, channel)
+        self.delivered += 1
+
+
+    def polyphonic_pressure(self, note, pressure, channel=0):
+        pressure = int(pressure)
+        self.__shape(POLYPHONIC_PRESSURE + (channel << 7) + int(note), pressure, pressure)
+
+
+    def control_change(self, controller_number, value, channel=0):
+        if controller_number >= CHANNEL_MODE:
+            self.__release_channel(channel)
+            self.__forget_channel(channel)
+            self.output.control_change(controller_number, value, channel)
+            self.delivered += 1
+        else:
+            value = int(value)
+            self.__shape(CONTROL_CHANGE + (channel << 7) + int(controller_number), value, value)
+
+
+    def program_change(self, program_number, channel=0):
+        self.__release_channel(channel)
+        self.output.program_change(program_number, channel)
+        self.delivered += 1
+
+
+    def channel_pressure(self, pressure, channel=0):
+        pressure = int(pressure)
+        self.__shape(CHANNEL_PRESSURE + channel, pressure, pressure)
+
+
+    def pitch_bend(self, bend, channel=0):
+        self.__shape(PITCH_BEND + channel, bend, bend_value(bend))
+
+
+    def rt_start(self):
+        self.output.rt_start()
+        self.delivered += 1
+
+
+    def rt_continue(self):
+        self.output.rt_continue()
+        self.delivered += 1
+
+
+    def rt_stop(self):
+        self.output.rt_stop()
+        self.delivered += 1
+
+
+    def rt_clock(self):
+        self.output.rt_clock()
+        self.delivered += 1
+
+
+    def flush(self):
+        """
+        Flushes the wrapped output.  Held back values wait for `poll`.
+        """
+        self.output.flush()
@@ -0,0 +1,301 @@
+import time
+import threading
+from array import array
+
+from timing import RollingStats
+
+
+NOTE_ON = 0
+NOTE_OFF = 1
+POLYPHONIC_PRESSURE = 2
+CONTROL_CHANGE = 3
+PROGRAM_CHANGE = 4
+CHANNEL_PRESSURE = 5
+PITCH_BEND = 6
+RT_START = 7
+RT_CONTINUE = 8
+RT_STOP = 9
+RT_CLOCK = 10
+
+
+
+
+class OutputThread:
+    """
+    An output stage that moves MIDI sending off of the thread that calls the send
+    functions.  Each call writes one fixed size record into a preallocated ring buffer,
+    and `flush` wakes a sender thread which replays the queued records against the
+    wrapped output functions in order and then flushes those once per batch.
+
+    The ring buffer is only safe with a single producer thread, which is the main loop
+    in a normal MollyTime session.  Because every message goes through one queue in
+    order, the ordering of messages on each channel is always preserved.
+    """
+
+
+    def __init__(self, output, capacity=4096):
+        """
+        Arg `output` is any object providing the functions in `midi.SEND_FUNCTIONS`,
+        usually the result of `midi.current_output()`.
+        Arg `capacity` is the number of messages the ring buffer can hold.
+
+        This is a cold path.
+        """
+
+        self.output = output
+        self.capacity = int(capacity)
+
+        # Four ints per message: the opcode followed by up to three integer arguments.
+        self.__codes = array("i", bytes(4 * 4 * self.capacity))
+
+        # Two floats per message: the time it was queued and the pitch bend amount.
+        self.__values = array("d", bytes(8 * 2 * self.capacity))
+
+        # Total messages written and read.  Only the producer writes `__head` and only
+        # the sender thread writes `__tail`.
+        self.__head = 0
+        self.__tail = 0
+
+        self.__wake = threading.Event()
+        self.__running = False
+        self.__thread = None
+
+        # Time from the oldest message of each batch being queued to the batch being
+        # flushed by the wrapped output.
+        self.latency = RollingStats()
+
+        # The number of times a producer had to wait for room in the ring buffer.
+        self.overruns = 0
+
+
+    @property
+    def depth(self):
+        """
+        The number of messages currently waiting to be sent.
+        """
+        return self.__head - self.__tail
+
+
+    def start(self):
+        """
+        This is a cold path.
+        """
+        if self.__thread is None:
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__run, name="MollyTime MIDI output", daemon=True)
+            self.__thread.start()
+
+
+    def stop(self):
+        """
+        Sends everything that is still queued and stops the sender thread.
+
+        This is a cold path.
+        """
+        if self.__thread is not None:
+            self.__running = False
+            self.__wake.set()
+            self.__thread.join()
+            self.__thread = None
+
+
+    def __push(self, opcode, a=0, b=0, c=0, bend=0.0):
+        """
+        This is a hot path.
+        """
+
+        head = self.__head
+        if head - self.__tail >= self.capacity:
+            self.overruns += 1
+            self.__wake.set()
+            while head - self.__tail >= self.capacity:
+                time.sleep(0)
+
+        slot = head % self.capacity
+        index = slot * 4
+        codes = self.__codes
+        codes[index] = opcode
+        codes[index + 1] = a
+        codes[index + 2] = b
+        codes[index + 3] = c
+
+        index = slot * 2
+        self.__values[index] = time.perf_counter()
+        self.__values[index + 1] = bend
+
+        self.__head = head + 1
+
+
+    def __run(self):
+        output = self.output
+        senders = (
+            lambda a, b, c, bend: output.note_on(a, b, c),
+            lambda a, b, c, bend: output.note_off(a, b, c),
+            lambda a, b, c, bend: output.polyphonic_pressure(a, b, c),
+            lambda a, b, c, bend: output.control_change(a, b, c),
+            lambda a, b, c, bend: output.program_change(a, b),
+            lambda a, b, c, bend: output.channel_pressure(a, b),
+            lambda a, b, c, bend: output.pitch_bend(bend, a),
+            lambda a, b, c, bend: output.rt_start(),
+            lambda a, b, c, bend: output.rt_continue(),
+            lambda a, b, c, bend: output.rt_stop(),
+            lambda a, b, c, bend: output.rt_clock())
+
+        codes = self.__codes
+        values = self.__values
+
+        while True:
+            self.__wake.wait()
+            self.__wake.clear()
+            running = self.__running
+
+            head = self.__head
+            tail = self.__tail
+            if head != tail:
+                oldest = values[(tail % self.capacity) * 2]
+
+                while tail != head:
+                    slot = tail % self.capacity
+                    index = slot * 4
+                    senders[codes[index]](codes[index + 1], codes[index + 2], codes[index + 3], values[slot * 2 + 1])
+                    tail += 1
+                    self.__tail = tail
+
+                output.flush()
+                self.latency.add(time.perf_counter() - oldest)
+
+            if not running:
+                break
+
+
+    def note_on(self, note, velocity, channel=0):
+        self.__push(NOTE_ON, int(note), int(velocity), int(channel))
+
+
+    def note_off(self, note, velocity=0, channel=0):
+        self.__push(NOTE_OFF, int(note), int(velocity), int(channel))
+
+
+    def polyphonic_pressure(self, note, pressure, channel=0):
+        self.__push(POLYPHONIC_PRESSURE, int(note), int(pressure), int(channel))
+
+
+    def control_change(self, controller_number, value, channel=0):
+        self.__push(CONTROL_CHANGE, int(controller_number), int(value), int(channel))
+
+
+    def program_change(self, program_number, channel=0):
+        self.__push(PROGRAM_CHANGE, int(program_number), int(channel))
+
+
+    def channel_pressure(self, pressure, channel=0):
+        self.__push(CHANNEL_PRESSURE, int(pressure), int(channel))
+
+
+    def pitch_bend(self, bend, channel=0):
+        self.__push(PITCH_BEND, int(channel), bend=bend)
+
+
+    def rt_start(self):
+        self.__push(RT_START)
+
+
+    def rt_continue(self):
+        self.__push(RT_CONTINUE)
+
+
+    def rt_stop(self):
+        self.__push(RT_STOP)
+
+
+    def rt_clock(self):
+        self.__push(RT_CLOCK)
+
+
+    def flush(self):
+        """
+        Wakes the sender thread to send everything queued so far.
+        """
+        self.__wake.set()
+
+
+
+
+class LockedOutput:
+    """
+    An output stage that takes a lock around every call, so that the send functions may
+    be called from more than one thread.  The other stages and the backends all assume
+    a single calling thread, so anything that sends MIDI from a thread of its own, such
+    as a ClockEngine, needs this in front of them.
+    """
+
+
+    def __init__(self, output):
+        """
+        Arg `output` is any object providing the functions in `midi.SEND_FUNCTIONS`,
+        usually the result of `midi.current_output()`.
+
+        This is a cold path.
+        """
+        self.output = output
+        self.lock = threading.Lock()
+
+
+    def note_on(self, note, velocity, channel=0):
+        with self.lock:
+            self.output.note_on(note, velocity, channel)
+
+
+    def note_off(self, note, velocity=0, channel=0):
+        with self.lock:
+            self.output.note_off(note, velocity, channel)
+
+
+    def polyphonic_pressure(self, note, pressure, channel=0):
+        with self.lock:
+            self.output.polyphonic_pressure(note, pressure, channel)
+
+
+    def control_change(self, controller_number, value, channel=0):
+        with self.lock:
+            self.output.control_change(controller_number, value, channel)
+
+
+    def program_change(self, program_number, channel=0):
+        with self.lock:
+            self.output.program_change(program_number, channel)
+
+
+    def channel_pressure(self, pressure, channel=0):
+        with self.lock:
+            self.output.channel_pressure(pressure, channel)
+
+
+    def pitch_bend(self, bend, channel=0):
+        with self.lock:
+            self.output.pitch_bend(bend, channel)
+
+
+    def rt_start(self):
+        with self.lock:
+            self.output.rt_start()
+
+
+    def rt_continue(self):
+        with self.lock:
+            self.output.rt_continue()
+
+
+    def rt_stop(self):
+        with self.lock:
+            self.output.rt_stop()
+
+
+    def rt_clock(self):
+        with self.lock:
+            self.output.rt_clock()
+
+
+    def flush(self):
+        with self.lock:
+            self.output.flush()
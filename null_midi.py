@@ -0,0 +1,83 @@
+# A MIDI backend that discards everything.  Select it by setting the environment
+# variable MOLLYTIME_MIDI to "null" before importing the midi module, eg. for running
+# benchmarks on machines without MIDI support.
+
+
+def note_on(note, velocity, channel=0):
+    pass
+
+
+def note_off(note, velocity=0, channel=0):
+    pass
+
+
+def polyphonic_pressure(note, pressure, channel=0):
+    pass
+
+
+def control_change(controller_number, value, channel=0):
+    pass
+
+
+def program_change(program_number, channel=0):
+    pass
+
+
+def channel_pressure(pressure, channel=0):
+    pass
+
+
+def pitch_bend(bend, channel=0):
+    pass
+
+
+def rt_start():
+    pass
+
+
+def rt_continue():
+    pass
+
+
+def rt_stop():
+    pass
+
+
+def rt_clock():
+    pass
+
+
+def flush():
+    pass
+
+
+def queue_time():
+    return 0.0, 0
+
+
+def set_queue_tempo(bpm):
+    pass
+
+
+def schedule_message(message, *args, tick=None, real_time=None):
+    pass
+
+
+def print_verbose_device_info():
+    pass
+
+
+def device_names():
+    return []
+
+
+def auto_connect_inner(device_priority):
+    return None
+
+
+def open_input(push):
+    pass
+
+
+def close_input():
+    pass
@@ -17,6 +17,13 @@ class PadTile(Tile):
     This implements an interactive MIDI pad that plays one note at maximum velocity.
     """
 
+    __slots__ = ("note", "rect", "idle_surface", "held_surface")
+
+    surface_attrs = ("idle_surface", "held_surface")
+
+    # Where a pad is pressed makes no difference, so it is never rubbed.
+    rub_steps = (0, 0)
+
     def __init__(self, rect, note, idle_color):
         self.rect = rect
         self.note = note
@@ -44,12 +51,20 @@ class PadTile(Tile):
         self.draw_params = [(self.idle_surface, self.rect)]
 
 
+    def light(self, on):
+        self.draw_params = [(self.held_surface if on else self.idle_surface, self.rect)]
+
+
 
 class PadArray(Plato):
     """
     This implements a 2D array of PadTile objects with an isomorphic note layout.
     """
 
+    # `match` always finds the same tile as `Plato.match` would.
+    exact_match = True
+
+
     def __init__(self, x, y, w, h, center_note, x_offset, y_offset, tile_pips=4, margin_pips=1, spacing_pips=1):
         """
         Args `x`, `y`, `tile_pips`, `margin_pips`, and `spacing_pips are specified as pip counts.
@@ -113,6 +128,15 @@ class PadArray(Plato):
 
         self.tiles = [None] * tile_count
 
+        # The pad grid is a regular lattice in screen space, which lets `match` find
+        # the pad under a point by division instead of searching.
+        pip_size = pip_to_rect(0, 0, 1, 1).w
+        origin = pip_to_rect(self.pip_min_x + self.margin_pips, self.pip_min_y + self.margin_pips, 1, 1)
+        self.__origin_x = origin.x
+        self.__origin_y = origin.y
+        self.__pad_size = self.tile_pips * pip_size
+        self.__pad_pitch = (self.tile_pips + self.spacing_pips) * pip_size
+
         for tile_index in range(tile_count):
             tile_x = tile_index % self.tile_w
             tile_y = tile_index // self.tile_w
@@ -127,6 +151,29 @@ class PadArray(Plato):
             self.tiles[tile_index] = tile
 
 
+    def match(self, point):
+        """
+        Finds the pad under the point from the grid geometry.  Points in the margin or
+        in the gutters between pads match nothing.
+
+        This is a hot path.
+        """
+        if self.__pad_pitch <= 0:
+            return None
+
+        tile_x, offset_x = divmod(int(point[0]) - self.__origin_x, self.__pad_pitch)
+        tile_y, offset_y = divmod(int(point[1]) - self.__origin_y, self.__pad_pitch)
+        if offset_x >= self.__pad_size or offset_y >= self.__pad_size:
+            return None
+        if tile_x < 0 or tile_y < 0 or tile_x >= self.tile_w or tile_y >= self.tile_h:
+            return None
+
+        tile = self.tiles[tile_y * self.tile_w + tile_x]
+        if tile.rect.collidepoint(point):
+            return tile
+        return None
+
+
 
 
 if __name__ == "__main__":
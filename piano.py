@@ -1,7 +1,9 @@
 
 import math
 import string
+import bisect
 import itertools
+from array import array
 
 import pygame_setup
 import pygame
@@ -20,6 +22,13 @@ class PianoTile(Tile):
     be a white key or a black key.
     """
 
+    __slots__ = ("note", "rect", "idle_surface", "held_surface")
+
+    surface_attrs = ("idle_surface", "held_surface")
+
+    # Where a key is pressed makes no difference, so it is never rubbed.
+    rub_steps = (0, 0)
+
     def __init__(self, rect, color, note, text, text_color=None):
         self.note = note
         self.rect = rect
@@ -48,6 +57,10 @@ class PianoTile(Tile):
         self.draw_params = [(self.idle_surface, self.rect)]
 
 
+    def light(self, on):
+        self.draw_params = [(self.held_surface if on else self.idle_surface, self.rect)]
+
+
 
 
 class Piano(Plato):
@@ -55,6 +68,9 @@ class Piano(Plato):
     Implements a row of interactive piano keys with an arbitrary root note and scale.
     """
 
+    # `match` always finds the same tile as `Plato.match` would.
+    exact_match = True
+
 
     def __init__(self, x, y, root=60, scale=[2, 2, 1, 2, 2, 2, 1], notes=13, wht_w=3, blk_h=5, wht_h=8, spill_mode=3):
         """
@@ -208,6 +224,47 @@ class Piano(Plato):
             text = midi.simple_note_name(note)
             self.tiles.append(PianoTile(blk_key, (32, 32, 32), note, text, (128, 128, 128)))
 
+        # Geometry used by `match`.  The white keys are a row of equally wide keys, and
+        # the black keys are kept sorted by their left edges for bisecting.
+        wht_count = len(wht_notes)
+        self.__wht_tiles = self.tiles[1:1 + wht_count]
+        self.__wht_x = wht_keys[0].x
+        self.__wht_w = wht_ref.w
+
+        blk_tiles = sorted(self.tiles[1 + wht_count:], key=lambda tile: tile.rect.x)
+        self.__blk_tiles = blk_tiles
+        self.__blk_lefts = array("l", [tile.rect.x for tile in blk_tiles])
+        self.__blk_top = min((tile.rect.top for tile in blk_tiles), default=0)
+        self.__blk_bottom = max((tile.rect.bottom for tile in blk_tiles), default=0)
+
+
+    def match(self, point):
+        """
+        Resolves the black keys first by bisecting their left edges, then the white
+        keys by dividing by the key width, and falls back to the frame tile.
+
+        This is a hot path.
+        """
+        x, y = point
+
+        if self.__blk_top <= y < self.__blk_bottom:
+            index = bisect.bisect_right(self.__blk_lefts, x) - 1
+            if index >= 0:
+                tile = self.__blk_tiles[index]
+                if tile.rect.collidepoint(point):
+                    return tile
+
+        if self.__wht_w > 0:
+            index = (int(x) - self.__wht_x) // self.__wht_w
+            if 0 <= index < len(self.__wht_tiles):
+                tile = self.__wht_tiles[index]
+                if tile.rect.collidepoint(point):
+                    return tile
+
+        if self.frame.collidepoint(point):
+            return self.tiles[0]
+        return None
+
 
 
 
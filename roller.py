@@ -23,6 +23,14 @@ class RollerTile(Tile):
     to bend the pitch and polyphonic aftertouch on channel 2 to change the velocity.
     """
 
+    __slots__ = ("note", "rect", "idle_surface", "held_surface")
+
+    surface_attrs = ("idle_surface", "held_surface")
+
+    # `rub` maps x to 127 steps and folds y onto 127 steps, so these cells line up
+    # exactly with the aftertouch values it sends.
+    rub_steps = (AFTERTOUCH_RANGE, AFTERTOUCH_RANGE * 2)
+
 
     def __init__(self, rect, color, note, text, text_color=None):
         self.note = note
@@ -63,6 +71,10 @@ class RollerTile(Tile):
         self.draw_params = [(self.idle_surface, self.rect)]
 
 
+    def light(self, on):
+        self.draw_params = [(self.held_surface if on else self.idle_surface, self.rect)]
+
+
 
 
 class RollerPlate(Plato):
@@ -71,6 +83,9 @@ class RollerPlate(Plato):
     velocity changes.
     """
 
+    # `match` always finds the same tile as `Plato.match` would.
+    exact_match = True
+
 
     def __init__(self, x, y, root=60, notes=13, tile_w=12, tile_h=12, margin=1):
         self.notes = [root + i for i in range(notes)]
@@ -92,9 +107,130 @@ class RollerPlate(Plato):
             rect = pip_to_rect(self.pip_min_x + index * self.tile_w, self.pip_min_y, self.tile_w, self.tile_h)
             name = midi.simple_note_name(note)
             bg_color = bg_colors[2 if name[1] in "♭♯" else index % 2]
-            tile = RollerTile(rect, bg_color, note, name, fg_color)
+            tile = self.new_tile(rect, bg_color, note, name, fg_color)
             self.tiles.append(tile)
 
+        # The keys are one row of equally wide tiles after the frame tile, which lets
+        # `match` find the key under a point by division instead of searching.
+        self.__key_x = self.tiles[1].rect.x if len(self.tiles) > 1 else 0
+        self.__key_w = pip_to_rect(0, 0, self.tile_w, 1).w
+
+
+    def new_tile(self, rect, color, note, text, text_color):
+        """
+        Creates the tile for one key.
+
+        This is a cold path.
+        """
+        return RollerTile(rect, color, note, text, text_color)
+
+
+    def match(self, point):
+        """
+        Finds the key under the point from the row geometry, falling back to the frame
+        tile.
+
+        This is a hot path.
+        """
+        if self.__key_w > 0:
+            index = (int(point[0]) - self.__key_x) // self.__key_w + 1
+            if 0 < index < len(self.tiles):
+                tile = self.tiles[index]
+                if tile.rect.collidepoint(point):
+                    return tile
+        if self.frame.collidepoint(point):
+            return self.tiles[0]
+        return None
+
+
+
+
+class MPERollerTile(RollerTile):
+    """
+    A RollerTile that plays its note on a channel of its own from an MPE zone, and sends
+    the pitch as per-channel pitch bend and the volume as channel pressure.  This sends
+    one note on and one note off per press instead of two of each.  The tile spans one
+    semitone, and the pitch bends by up to half a semitone either way from its center.
+    """
+
+    __slots__ = ("zone", "channel")
+
+    # Finer than pitch bend can resolve over one semitone with the default range of 48
+    # semitones, which is about 171 steps.
+    rub_steps = (256, AFTERTOUCH_RANGE * 2)
+
+
+    def __init__(self, rect, color, note, text, text_color, zone):
+        super().__init__(rect, color, note, text, text_color)
+        self.zone = zone
+
+        # The member channel the note is playing on, or -1.
+        self.channel = -1
+
+
+    def hold(self, x, y):
+        self.channel = self.zone.acquire(self)
+        self.draw_params = [(self.held_surface, self.rect)]
+
+        # The expression is sent before the note on so the note starts out with it.
+        self.rub(x, y)
+        midi.note_on(self.note, 127, self.channel)
+
+
+    def rub(self, x, y):
+        channel = self.channel
+        if channel >= 0:
+            x = min(max(x, 0.0), 1.0)
+            y = (1.0 - abs(y * 2 - 1))
+            volume = min(max(y * AFTERTOUCH_RANGE + AFTERTOUCH_MIN, AFTERTOUCH_MIN), AFTERTOUCH_MAX)
+            midi.pitch_bend((x - .5) / self.zone.bend_range, channel)
+            midi.channel_pressure(volume, channel)
+
+
+    def release(self):
+        channel = self.channel
+        if channel >= 0:
+            midi.note_off(self.note, channel=channel)
+            self.zone.release(channel, self)
+            self.channel = -1
+        self.draw_params = [(self.idle_surface, self.rect)]
+
+
+    def stolen(self, channel):
+        """
+        Called by the zone when it takes the channel away for another note.  The tile
+        stays held, but silent, until it is released.
+        """
+        midi.note_off(self.note, channel=channel)
+        self.channel = -1
+
+
+
+
+class MPERollerPlate(RollerPlate):
+    """
+    A RollerPlate made of MPERollerTiles.  Plates can share one zone.  The zone is
+    configured on the synth the first time a plate using it is populated.
+    """
+
+
+    def __init__(self, x, y, zone, root=60, notes=13, tile_w=12, tile_h=12, margin=1):
+        """
+        Arg `zone` is the midi.MPEZone the notes are played in.
+        """
+        self.zone = zone
+        super().__init__(x, y, root, notes, tile_w, tile_h, margin)
+
+
+    def populate(self, pip_to_rect):
+        if not self.zone.configured:
+            self.zone.configure(midi)
+        super().populate(pip_to_rect)
+
+
+    def new_tile(self, rect, color, note, text, text_color):
+        return MPERollerTile(rect, color, note, text, text_color, self.zone)
+
 
 if __name__ == "__main__":
     root = 60 - 12 * 3
@@ -0,0 +1,227 @@
+"""
+A persistent cache of finished `surface_tools.text_rect` surfaces, so that labels do not
+need to be measured, rendered, and composited again on every launch.
+
+Everything lives in one pack file: a header, an index of entries, and then the raw RGB
+pixels of every entry.  The pack is memory mapped when loaded, and surfaces are read
+out of the mapping as they are asked for.  Entries are keyed by a hash of the full
+`text_rect` parameters, the contents of the font file, and the pygame and SDL_ttf
+versions, so a change to any of them simply stops matching the old entries, which
+then age out of the pack.
+"""
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+import platform
+
+import pygame_setup
+import pygame
+
+
+MAGIC = b"MTSC"
+VERSION = 3
+HEADER = struct.Struct("<4sHI")
+ENTRY = struct.Struct("<20sQHH")
+
+PACK_NAME = "text_rect.pack"
+
+# The most pixel data the pack may hold.  Entries used in the current session are kept
+# first, and older entries fill the rest in the order they were stored.
+MAX_BYTES = 64 * 1024 * 1024
+
+
+
+
+def user_cache_dir():
+    """
+    Returns the per-user cache directory for this program, following platform
+    conventions.  The directory is not created.
+    """
+    system = platform.system()
+    if system == "Windows":
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif system == "Darwin":
+        root = os.path.expanduser("~/Library/Caches")
+    else:
+        root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(root, "mollytime")
+
+
+
+
+class SurfaceCache:
+    """
+    Loads and stores surfaces by key in a pack file.  Lookups are served from the pack
+    that existed when the cache was opened, and newly stored surfaces are only written
+    out by `save`.
+    """
+
+
+    def __init__(self, directory=None):
+        """
+        Arg `directory` defaults to `user_cache_dir()`.
+
+        This is a cold path.
+        """
+
+        self.path = os.path.join(directory or user_cache_dir(), PACK_NAME)
+        self.hits = 0
+        self.misses = 0
+
+        # Identifies the renderer, so entries made by a different pygame or SDL_ttf
+        # are never used.
+        self.__salt = repr((VERSION, pygame.version.ver, pygame.font.get_sdl_ttf_version()))
+        self.__font_hashes = {}
+
+        # Maps digests to `(offset, w, h)` within the mapped pack.
+        self.__index = {}
+        self.__pack = None
+
+        # Digests in the order they were used or stored this session, mapped to their
+        # pixels when they were stored this session, or to None when they came from the
+        # pack.
+        self.__used = {}
+
+        self.__load()
+
+
+    def __load(self):
+        try:
+            with open(self.path, "rb") as pack_file:
+                pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+
+        try:
+            magic, version, count = HEADER.unpack_from(pack, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("stale surface cache")
+            index = {}
+            for entry in range(count):
+                digest, offset, w, h = ENTRY.unpack_from(pack, HEADER.size + entry * ENTRY.size)
+                if offset + w * h * 3 > len(pack):
+                    raise ValueError("truncated surface cache")
+                index[digest] = (offset, w, h)
+        except (struct.error, ValueError):
+            pack.close()
+            return
+
+        self.__index = index
+        self.__pack = pack
+
+
+    def font_hash(self, font_path):
+        """
+        Returns a hash of the contents of a font file, reading it only once.
+        """
+        font_path = str(font_path)
+        font_hash = self.__font_hashes.get(font_path)
+        if font_hash is None:
+            with open(font_path, "rb") as font_file:
+                font_hash = hashlib.sha1(font_file.read()).hexdigest()
+            self.__font_hashes[font_path] = font_hash
+        return font_hash
+
+
+    def digest(self, key, font_path):
+        """
+        Returns the digest that identifies `key` rendered with the given font file.
+        """
+        text = repr((self.__salt, self.font_hash(font_path), key))
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+    def load(self, digest):
+        """
+        Returns a new surface with the pixels stored under `digest`, or None.
+        """
+        entry = self.__index.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        offset, w, h = entry
+        pixels = pygame.image.frombytes(self.__pack[offset:offset + w * h * 3], (w, h), "RGB")
+
+        # Copy into a surface of the same format `surface_tools.rect` creates, so a
+        # cached surface blits exactly like a freshly rendered one.
+        surface = pygame.Surface((w, h))
+        surface.blit(pixels, (0, 0))
+
+        self.hits += 1
+        self.__used[digest] = None
+        return surface
+
+
+    def store(self, digest, surface):
+        """
+        Remembers the pixels of `surface` to be written out by `save`.
+        """
+        w, h = surface.get_size()
+        self.__used[digest] = (w, h, pygame.image.tobytes(surface, "RGB"))
+
+
+    def save(self):
+        """
+        Writes the pack back to disk if anything new was stored this session.  The new
+        pack is written next to the old one and moved into place, so an interrupted save
+        never leaves a broken pack behind.
+
+        This is a cold path.
+        """
+
+        if not any(self.__used.values()):
+            return
+
+        entries = []
+        total = 0
+
+        def add(digest, w, h, pixels):
+            nonlocal total
+            if total + len(pixels) <= MAX_BYTES:
+                entries.append((digest, w, h, pixels))
+                total += len(pixels)
+
+        for digest, stored in self.__used.items():
+            if stored:
+                add(digest, *stored)
+            elif digest in self.__index:
+                offset, w, h = self.__index[digest]
+                add(digest, w, h, self.__pack[offset:offset + w * h * 3])
+
+        for digest, (offset, w, h) in self.__index.items():
+            if digest not in self.__used:
+                add(digest, w, h, self.__pack[offset:offset + w * h * 3])
+
+        temp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temp_path, "wb") as pack_file:
+                pack_file.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+                offset = HEADER.size + len(entries) * ENTRY.size
+                for digest, w, h, pixels in entries:
+                    pack_file.write(ENTRY.pack(digest, offset, w, h))
+                    offset += len(pixels)
+                for digest, w, h, pixels in entries:
+                    pack_file.write(pixels)
+            self.close()
+            os.replace(temp_path, self.path)
+        except OSError as error:
+            print(f"Unable to save the surface cache: {error}", file=sys.stderr)
+            return
+
+        self.__used = {digest: None for digest in self.__used}
+        self.__load()
+
+
+    def close(self):
+        """
+        Releases the mapped pack.  Lookups miss until it is loaded again.
+        """
+        if self.__pack is not None:
+            self.__pack.close()
+            self.__pack = None
+        self.__index = {}
@@ -1,16 +1,184 @@
 
+import sys
 import string
+from collections import OrderedDict
 from importlib import resources
 
 import pygame_setup
 import pygame
 
 import media
+from surface_cache import SurfaceCache
 
 
-SURFACE_VAULT = {}
+# Default pixel memory budget of the surface vault in bytes.
+VAULT_BUDGET = 256 * 1024 * 1024
+
+
+
+
+class SurfaceVault:
+    """
+    Memoizes generated surfaces by key within a budget of pixel memory.  When the budget
+    is exceeded, the least recently used surfaces are evicted first.  Surfaces that are
+    still referenced from outside the vault, such as by the tiles of a live play
+    surface, are pinned and never evicted, so a cache miss never duplicates a surface
+    that is on screen.  Surfaces from layouts that have been dropped become evictable.
+
+    Hit, miss, and eviction counts are kept for inspection.
+    """
+
+
+    def __init__(self, budget=VAULT_BUDGET):
+        """
+        Arg `budget` is the number of bytes of pixel memory the vault may hold before
+        it starts evicting surfaces.
+
+        This is a cold path.
+        """
+
+        self.budget = budget
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.__surfaces = OrderedDict()
+
+        # The reference count of a surface held by nothing but the vault, as seen by
+        # `__pinned`.  This is measured rather than assumed because it depends on the
+        # Python version.
+        self.__surfaces[None] = pygame.Surface((1, 1))
+        self.__unreferenced = 0
+        self.__unreferenced = sys.getrefcount(self.__surfaces[None])
+        del self.__surfaces[None]
+
+
+    def __len__(self):
+        return len(self.__surfaces)
+
+
+    def __contains__(self, key):
+        return key in self.__surfaces
+
+
+    @staticmethod
+    def surface_bytes(surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+    def get(self, key):
+        """
+        Returns the surface stored under `key`, or None.
+        """
+        surface = self.__surfaces.get(key)
+        if surface is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__surfaces.move_to_end(key)
+        return surface
+
+
+    def put(self, key, surface):
+        """
+        Stores a surface under `key`, evicting other surfaces if this puts the vault
+        over budget.
+        """
+        old = self.__surfaces.pop(key, None)
+        if old is not None:
+            self.bytes -= self.surface_bytes(old)
+
+        self.__surfaces[key] = surface
+        self.bytes += self.surface_bytes(surface)
+
+        if self.bytes > self.budget:
+            self.evict()
+
+
+    def __pinned(self, key):
+        return sys.getrefcount(self.__surfaces[key]) > self.__unreferenced
+
+
+    def evict(self):
+        """
+        Evicts unpinned surfaces in least recently used order until the vault is within
+        budget or only pinned surfaces are left.  Pinned surfaces are treated as recently
+        used, since something is using them.
+        """
+        for index in range(len(self.__surfaces)):
+            if self.bytes <= self.budget:
+                break
+            key = next(iter(self.__surfaces))
+            if self.__pinned(key):
+                self.__surfaces.move_to_end(key)
+            else:
+                self.bytes -= self.surface_bytes(self.__surfaces.pop(key))
+                self.evictions += 1
+
+
+    def remap(self, mapping):
+        """
+        Replaces stored surfaces with equally sized substitutes.  Arg `mapping` maps the
+        id of a stored surface to its substitute.
+        """
+        for key, surface in self.__surfaces.items():
+            substitute = mapping.get(id(surface))
+            if substitute is not None:
+                self.__surfaces[key] = substitute
+
+
+    def clear(self):
+        """
+        Empties the vault and resets its counters.
+        """
+        self.__surfaces.clear()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def stats(self):
+        """
+        Returns a dict of the vault's counters and memory use.
+        """
+        pinned = sum(1 for key in self.__surfaces if self.__pinned(key))
+        return {
+            "surfaces": len(self.__surfaces),
+            "pinned": pinned,
+            "bytes": self.bytes,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+
+
+SURFACE_VAULT = SurfaceVault()
 FONTS = {}
 
+# The advances of rendered characters keyed by font, character, and color, or None if
+# the font has no metrics for a character.  The rendered characters themselves are kept
+# in the surface vault, so they count against its budget.
+GLYPHS = {}
+
+# Whether each pair of characters composed from glyphs looks the same as the pair
+# rendered whole, keyed by font and pair.  Pairs that the font kerns do not.
+PAIRS = {}
+
+# The vertical extent of exemplar strings keyed by font and exemplar.
+METRICS = {}
+
+# Labels in smaller fonts are always rendered whole, since hinting places their glyphs
+# differently when they are rendered together.
+MIN_COMPOSED_SIZE = 24
+
+# The optional SurfaceCache that `text_rect` results are persisted in.
+DISK_CACHE = None
+
 FONT_NAMES = {
     "overpass" : resources.files(media) / "overpass" / "static" / "Overpass-ExtraLight.ttf",
     "gentium_book_plus" : resources.files(media) / "gentium_book_plus" / "GentiumBookPlus-Regular.ttf",
@@ -18,69 +186,195 @@ FONT_NAMES = {
 
 
 def reset_memo():
-    global SURFACE_VAULT
-    SURFACE_VAULT = {}
+    SURFACE_VAULT.clear()
+    GLYPHS.clear()
+    PAIRS.clear()
+    METRICS.clear()
+
+
+def enable_disk_cache(directory=None):
+    """
+    Starts persisting `text_rect` results in a SurfaceCache, see `surface_cache`.
+
+    This is a cold path.
+    """
+    global DISK_CACHE
+    if DISK_CACHE is None:
+        DISK_CACHE = SurfaceCache(directory)
+    return DISK_CACHE
+
+
+def save_disk_cache():
+    """
+    Writes out any new `text_rect` results if the disk cache is enabled.
+
+    This is a cold path.
+    """
+    if DISK_CACHE is not None:
+        DISK_CACHE.save()
 
 
 def rect(size, color):
-    global SURFACE_VAULT
     key = (size, color)
-    surface = SURFACE_VAULT.get(key, None)
+    surface = SURFACE_VAULT.get(key)
 
     if surface:
         return surface
 
     surface = pygame.Surface(size)
     surface.fill(color)
-    SURFACE_VAULT[key] = surface
+    SURFACE_VAULT.put(key, surface)
     return surface
 
 
+def load_font(font_name, font_size):
+    font_key = (font_name, int(font_size))
+    font = FONTS.get(font_key, None)
+    if not font:
+        font = pygame.font.Font(FONT_NAMES[font_name], int(font_size))
+        FONTS[font_key] = font
+    return font
+
+
+def glyph(font_name, font_size, char, color):
+    """
+    Returns a `(surface, advance)` tuple for a single rendered character, or None if the
+    font has no metrics for it.
+    """
+    # Tagged so that it never matches the key of a one character label from `text`.
+    glyph_key = ("glyph", (font_name, int(font_size)), char, color)
+    advance = GLYPHS.get(glyph_key, False)
+    if advance is None:
+        return None
+
+    surface = SURFACE_VAULT.get(glyph_key)
+    if surface is None:
+        font = load_font(font_name, font_size)
+        if advance is False:
+            metrics = font.metrics(char)
+            advance = metrics[0][4] if len(metrics) == 1 and metrics[0] else None
+            GLYPHS[glyph_key] = advance
+            if advance is None:
+                return None
+        surface = font.render(char, True, color)
+        SURFACE_VAULT.put(glyph_key, surface)
+    return (surface, advance)
+
+
+def compose(glyphs, height):
+    """
+    Returns a surface with the `(surface, advance)` tuples in `glyphs` placed side by
+    side by their advances.
+    """
+    width = 0
+    pen = 0
+    for glyph_surface, advance in glyphs:
+        width = max(width, pen + glyph_surface.get_width())
+        pen += advance
+    surface = pygame.Surface((max(width, pen), height), pygame.SRCALPHA)
+    pen = 0
+    for glyph_surface, advance in glyphs:
+        surface.blit(glyph_surface, (pen, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        pen += advance
+    return surface
+
+
+def composes(font_name, font_size, pair):
+    """
+    Returns whether the two characters in `pair` come out the same composed from glyphs
+    as rendered whole.  pygame does not expose kerning, but a kerned pair renders at a
+    different width than its glyphs placed by their advances add up to.
+    """
+    pair_key = ((font_name, int(font_size)), pair)
+    same = PAIRS.get(pair_key)
+    if same is None:
+        (first, advance), (second, second_advance) = [glyph(font_name, font_size, char, (0, 0, 0)) for char in pair]
+        width = max(first.get_width(), advance + second.get_width(), advance + second_advance)
+        same = load_font(font_name, font_size).size(pair)[0] == width
+        PAIRS[pair_key] = same
+    return same
+
+
 def text(font_name, font_size, label, color):
-    global SURFACE_VAULT
-    global FONTS
+    """
+    Labels are composed from cached glyphs placed by their advances, since they are all
+    made from the same few characters.  A label is rendered whole instead when its font
+    is smaller than MIN_COMPOSED_SIZE, when the font has no metrics for one of its
+    characters, or when the font kerns one of its pairs of characters, see `composes`.
+    """
 
     font_key = (font_name, int(font_size))
     surface_key = (font_key, label, color)
 
-    surface = SURFACE_VAULT.get(surface_key, None)
+    surface = SURFACE_VAULT.get(surface_key)
     if surface:
         return surface
 
-    font = FONTS.get(font_key, None)
-    if not font:
-        font = pygame.font.Font(FONT_NAMES[font_name], int(font_size))
-        FONTS[font_key] = font
+    font = load_font(font_name, font_size)
+
+    glyphs = None
+    if label and int(font_size) >= MIN_COMPOSED_SIZE:
+        glyphs = [glyph(font_name, font_size, char, color) for char in label]
+        if not all(glyphs):
+            glyphs = None
+        else:
+            for index in range(len(label) - 1):
+                if not composes(font_name, font_size, label[index:index + 2]):
+                    glyphs = None
+                    break
+
+    if glyphs:
+        surface = compose(glyphs, font.get_height())
+    else:
+        surface = font.render(label, True, color)
 
-    surface = font.render(label, True, color)
-    SURFACE_VAULT[surface_key] = surface
+    SURFACE_VAULT.put(surface_key, surface)
     return surface
 
 
-def text_rect(size, bg_color, font_name, font_size, label, fg_color=(0, 0, 0), h_align=.5, v_align=.5, exemplar=string.digits):
-    global SURFACE_VAULT
-    global FONTS
+def font_extent(font_name, font_size, exemplar):
+    """
+    Returns the lowest and highest glyph extents above the baseline for the
+    characters in `exemplar`.
+    """
+    metrics_key = ((font_name, int(font_size)), exemplar)
+    extent = METRICS.get(metrics_key)
+    if extent is None:
+        font_min_y = 100000
+        font_max_y = -100000
+        for min_x, max_x, min_y, max_y, advance in load_font(font_name, font_size).metrics(exemplar):
+            font_min_y = min(font_min_y, min_y)
+            font_max_y = max(font_max_y, max_y)
+        extent = (font_min_y, font_max_y)
+        METRICS[metrics_key] = extent
+    return extent
+
 
+def text_rect(size, bg_color, font_name, font_size, label, fg_color=(0, 0, 0), h_align=.5, v_align=.5, exemplar=string.digits):
     font_key = (font_name, int(font_size))
     text_key = (font_key, label, fg_color)
     rect_key = (size, bg_color)
     surface_key = (rect_key, text_key, h_align, v_align, exemplar)
 
-    surface = SURFACE_VAULT.get(surface_key, None)
+    surface = SURFACE_VAULT.get(surface_key)
     if surface:
         return surface
 
+    digest = None
+    if DISK_CACHE is not None:
+        digest = DISK_CACHE.digest(surface_key, FONT_NAMES[font_name])
+        surface = DISK_CACHE.load(digest)
+        if surface:
+            SURFACE_VAULT.put(surface_key, surface)
+            return surface
+
     bg = rect(size, bg_color)
     fg = text(font_name, font_size, label, fg_color)
 
     font = FONTS.get(font_key, None)
     assert(font)
 
-    font_min_y = 100000
-    font_max_y = -100000
-    for min_x, max_x, min_y, max_y, advance in font.metrics(exemplar):
-        font_min_y = min(font_min_y, min_y)
-        font_max_y = max(font_max_y, max_y)
+    font_min_y, font_max_y = font_extent(font_name, font_size, exemplar)
 
     x = (bg.get_width() - fg.get_width()) * h_align
     y = -(font.get_ascent() - (font_min_y + font_max_y)) # starting top align offset
@@ -91,6 +385,8 @@ def text_rect(size, bg_color, font_name, font_size, label, fg_color=(0, 0, 0), h
     surface = bg.copy()
     surface.blit(fg, (x, y))
 
-    SURFACE_VAULT[surface_key] = surface
+    SURFACE_VAULT.put(surface_key, surface)
+    if digest is not None:
+        DISK_CACHE.store(digest, surface)
 
     return surface
@@ -1,12 +1,11 @@
-
 import midi
 import time
 import random
 
+from midi_clock import ClockEngine
 
-def thunk():
-    midi.rt_start()
 
+def thunk():
     # At this time of writing, I have my MicroFreak set to channel 3.
     # CC 92 controls the tempo for the MicroFreak.  The MIDI Control Center says this is
     # "Tremolo Depth" (which is the generic name for the control), but this very definitely
@@ -16,46 +15,49 @@ def thunk():
 
     midi.flush()
 
-    try:
-        note = 0
-        loop_count = 0
-        paused = False
+    note = 0
+    loop_count = 0
 
-        tempo = [120, 120, 60, -120, 240, 240]
-        print(tempo)
+    tempo = [120, 120, 60, -120, 240, 240]
+    print(tempo)
 
-        while True:
-            bpm = tempo[note]
-            next_bpm = tempo[(note + 1) % len(tempo)]
-            interval = 60 / (abs(bpm) * 24)
+    def on_pulse(pulse):
+        nonlocal note
+        nonlocal loop_count
 
-            if bpm > 0 and paused:
-                midi.rt_continue()
-                paused = False
+        # Tempo and transport changes happen on beat boundaries.
+        if pulse % 24 != 23:
+            return
 
-            for c in range(24):
-                midi.rt_clock()
-                midi.flush()
+        next_bpm = tempo[(note + 1) % len(tempo)]
+        if next_bpm < 0:
+            clock.stop()
 
-                if c == 23 and next_bpm < 0:
-                    midi.rt_stop()
-                    midi.flush()
-                    paused = True
+        note = (note + 1) % len(tempo)
+        if note == 0:
+            loop_count += 1
 
-                time.sleep(interval)
+            if (loop_count % 3) == 0:
+                random.shuffle(tempo)
+                while tempo[0] < 0 or tempo[-1] < 0:
+                    random.shuffle(tempo)
+                print(tempo)
 
-            note = (note + 1) % len(tempo)
-            if note == 0:
-                loop_count += 1
+        bpm = tempo[note]
+        clock.bpm = bpm
+        if bpm > 0 and not clock.playing:
+            clock.resume()
 
-                if (loop_count % 3) == 0:
-                    random.shuffle(tempo)
-                    while tempo[0] < 0 or tempo[-1] < 0:
-                        random.shuffle(tempo)
-                    print(tempo)
+    clock = ClockEngine(tempo[0], callback=on_pulse)
+    clock.start()
+
+    try:
+        while True:
+            time.sleep(1)
 
     except KeyboardInterrupt:
-        midi.rt_stop()
-        midi.flush()
+        clock.stop()
+        clock.close()
+        print(f"Clock jitter: {clock.jitter}")
 
 midi.run(thunk)
@@ -0,0 +1,157 @@
+"""
+Records a synthetic session with `input_log`, replays it through a headless play
+surface, and checks that the same tile hooks run and the same MIDI goes out as when
+the session was played live.
+
+Run with `python -m pytest`.  This uses SDL's dummy video driver and the null MIDI
+backend, so it needs neither a screen nor MIDI hardware.
+"""
+
+import os
+
+os.environ["MOLLYTIME_MIDI"] = "null"
+
+import pygame_setup
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+import pygame
+
+import pytest
+
+import midi
+import input_log
+import surface_tools
+from widgets import PlaySurface
+from roller import RollerPlate, RollerTile
+
+
+SCREEN_SIZE = (640, 360)
+
+
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """
+    Collects every tile hook and MIDI send in the order they happen.
+    """
+
+    calls = []
+
+    for hook in ("hold", "rub", "release"):
+        original = getattr(RollerTile, hook)
+        def recorded(tile, *args, hook=hook, original=original):
+            calls.append((hook, tile.note))
+            return original(tile, *args)
+        monkeypatch.setattr(RollerTile, hook, recorded)
+
+    class Output:
+        def __getattr__(self, name):
+            if name == "flush":
+                return lambda: None
+            return lambda *args, **kwargs: calls.append((name,) + args + tuple(kwargs.values()))
+
+    saved = midi.current_output()
+    midi.install_output(Output())
+    pygame.font.init()
+    yield calls
+    midi.install_output(saved)
+    surface_tools.reset_memo()
+
+
+def make_surface():
+    play_surface = PlaySurface(SCREEN_SIZE, [RollerPlate(0, 0, notes=5)])
+    play_surface.headless = True
+    return play_surface
+
+
+def rollers(play_surface):
+    return [tile for tile in play_surface.tiles if isinstance(tile, RollerTile)]
+
+
+def session(play_surface):
+    """
+    Returns batches of events as the main loop would fetch them: a finger pressing one
+    tile and sliding to the next, a second finger joining and lifting, and a mouse
+    click on a third tile.
+    """
+
+    screen_w, screen_h = SCREEN_SIZE
+    centers = [tile.rect.center for tile in rollers(play_surface)]
+
+    def finger(event_type, finger_id, tile_index, offset=0):
+        x, y = centers[tile_index]
+        return pygame.event.Event(
+            event_type, touch_id=0, finger_id=finger_id, x=(x + offset) / (screen_w - 1),
+            y=y / (screen_h - 1), dx=0.0, dy=0.0, pressure=1.0)
+
+    def mouse(event_type, tile_index):
+        return pygame.event.Event(event_type, pos=centers[tile_index], button=1, touch=False)
+
+    return [
+        [finger(pygame.FINGERDOWN, 1, 0)],
+        [finger(pygame.FINGERMOTION, 1, 0, 3), finger(pygame.FINGERMOTION, 1, 0, 6)],
+        [finger(pygame.FINGERMOTION, 1, 1), finger(pygame.FINGERDOWN, 2, 3)],
+        [pygame.event.Event(pygame.WINDOWENTER), finger(pygame.FINGERUP, 2, 3)],
+        [finger(pygame.FINGERUP, 1, 1)],
+        [mouse(pygame.MOUSEBUTTONDOWN, 2)],
+        [mouse(pygame.MOUSEBUTTONUP, 2)],
+    ]
+
+
+def test_replay_matches_live_session(calls, tmp_path):
+    path = tmp_path / "session.mtil"
+
+    play_surface = make_surface()
+    recorder = input_log.InputRecorder(path, SCREEN_SIZE)
+    for events in session(play_surface):
+        batch_start = True
+        for event in events:
+            if recorder.record(event, 0.0, batch_start):
+                batch_start = False
+        for event in play_surface.coalesce_events(events):
+            play_surface.input_event(event)
+        play_surface.crank()
+    recorder.close()
+
+    live = list(calls)
+    calls.clear()
+
+    replayed = input_log.replay(path, make_surface())
+
+    assert replayed == 9
+    assert calls == live
+
+    notes = [tile.note for tile in rollers(play_surface)]
+    hooks = [call for call in live if call[0] in ("hold", "release")]
+    assert hooks == [
+        ("hold", notes[0]),
+        ("release", notes[0]),
+        ("hold", notes[1]),
+        ("hold", notes[3]),
+        ("release", notes[3]),
+        ("release", notes[1]),
+        ("hold", notes[2]),
+        ("release", notes[2]),
+    ]
+    assert ("rub", notes[0]) in live
+    assert ("note_on", notes[0], 127, 1) in live
+    assert ("note_off", notes[2], 2) == live[-1]
+
+
+def test_log_keeps_batches(calls, tmp_path):
+    path = tmp_path / "session.mtil"
+
+    play_surface = make_surface()
+    recorder = input_log.InputRecorder(path, SCREEN_SIZE)
+    batches = session(play_surface)
+    for events in batches:
+        batch_start = True
+        for event in events:
+            if recorder.record(event, 0.0, batch_start):
+                batch_start = False
+    recorder.close()
+
+    screen_size, logged = input_log.read_log(path)
+
+    assert screen_size == SCREEN_SIZE
+    assert [len(batch) for batch in logged] == [1, 2, 2, 1, 1, 1, 1]
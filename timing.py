@@ -0,0 +1,289 @@
+import time
+import threading
+from array import array
+
+import pygame_setup
+import pygame
+
+
+
+
+def event_time(event):
+    """
+    Returns the time at which a pygame event arrived in the same time base as
+    `time.perf_counter`.  SDL event timestamps are used when pygame provides them, but
+    pygame 2 does not, so in practice this is the time of the call.  Call it as soon
+    as the event is fetched, and keep in mind that it then leaves out how long the
+    event sat in SDL's queue, including how long the main loop took to wake up.
+
+    This is a hot path.
+    """
+
+    now = time.perf_counter()
+    timestamp = getattr(event, "timestamp", None)
+    if timestamp:
+        return now - max(pygame.time.get_ticks() - timestamp, 0) / 1000
+    return now
+
+
+
+
+class RollingStats:
+    """
+    Keeps the most recent samples of a measurement in a fixed size ring buffer so that
+    summary statistics can be queried at any time without memory growing over a long
+    session.  Samples are in seconds.
+    """
+
+
+    def __init__(self, capacity=4096):
+        """
+        This is a cold path.
+        """
+
+        self.capacity = int(capacity)
+        self.samples = array("d", bytes(8 * self.capacity))
+
+        # The total number of samples ever added.  Only the last `capacity` are kept.
+        self.count = 0
+
+
+    def add(self, sample):
+        """
+        This is a hot path.
+        """
+
+        self.samples[self.count % self.capacity] = sample
+        self.count += 1
+
+
+    def recent(self):
+        """
+        Returns the retained samples in no particular order.
+        """
+        return self.samples[:min(self.count, self.capacity)]
+
+
+    def mean(self):
+        samples = self.recent()
+        return sum(samples) / len(samples) if samples else 0.0
+
+
+    def percentile(self, fraction):
+        """
+        Arg `fraction` is a number between 0.0 and 1.0 inclusive.
+        """
+        samples = sorted(self.recent())
+        if not samples:
+            return 0.0
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+    def maximum(self):
+        samples = self.recent()
+        return max(samples) if samples else 0.0
+
+
+    def histogram(self, edges):
+        """
+        Arg `edges` is an ascending list of bin edges in seconds.  Returns a list of
+        sample counts with one more entry than `edges`, where entry `i` counts the
+        retained samples below `edges[i]` and not counted by an earlier entry, and the
+        last entry counts everything else.
+        """
+        counts = [0] * (len(edges) + 1)
+        for sample in self.recent():
+            index = 0
+            while index < len(edges) and sample >= edges[index]:
+                index += 1
+            counts[index] += 1
+        return counts
+
+
+    def summary(self):
+        """
+        Returns a dict with the sample count and the mean, 99th percentile, and maximum
+        of the retained samples.
+        """
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "p99": self.percentile(.99),
+            "max": self.maximum(),
+        }
+
+
+    def __str__(self):
+        summary = self.summary()
+        return (
+            f"{summary['count']} samples, "
+            f"mean {summary['mean'] * 1000:.3f} ms, "
+            f"p99 {summary['p99'] * 1000:.3f} ms, "
+            f"max {summary['max'] * 1000:.3f} ms")
+
+
+
+
+class LatencyMonitor:
+    """
+    Follows input through the main loop to measure how long it takes to turn into MIDI
+    output and into pixels on screen.  The main loop reports when input is fetched, the
+    play surface reports when it has cranked, and the main loop reports when the frame
+    is presented.  When several events are handled together, the oldest one is used.
+
+    Input is stamped with `event_time`, which without SDL timestamps is the time the
+    main loop fetched it, so both measurements start at the fetch and leave out the
+    time spent waiting in SDL's queue before it.
+    """
+
+
+    # Histogram bin edges in seconds used by `report`.
+    EDGES = (.0005, .001, .002, .004, .008, .016, .033)
+
+
+    def __init__(self, capacity=4096):
+        """
+        This is a cold path.
+        """
+
+        self.fetch_to_midi = RollingStats(capacity)
+        self.fetch_to_pixels = RollingStats(capacity)
+
+        # Arrival time of the oldest input not yet handled by a crank.
+        self.__pending = None
+
+        # Arrival time of the oldest input whose effects are waiting to be presented.
+        self.__presenting = None
+
+
+    def arrived(self, stamp):
+        """
+        Arg `stamp` is the arrival time of some input, as returned by `event_time`,
+        which is usually the time it was fetched.
+
+        This is a hot path.
+        """
+        if self.__pending is None or stamp < self.__pending:
+            self.__pending = stamp
+
+
+    def cranked(self, sent_midi, changed_pixels):
+        """
+        Called by the play surface at the end of every crank, right after MIDI output
+        is flushed.
+
+        This is a hot path.
+        """
+        stamp = self.__pending
+        if stamp is None:
+            return
+        self.__pending = None
+
+        if sent_midi:
+            self.fetch_to_midi.add(time.perf_counter() - stamp)
+
+        if changed_pixels and (self.__presenting is None or stamp < self.__presenting):
+            self.__presenting = stamp
+
+
+    def presented(self):
+        """
+        Called by the main loop after the display is updated.
+
+        This is a hot path.
+        """
+        if self.__presenting is not None:
+            self.fetch_to_pixels.add(time.perf_counter() - self.__presenting)
+            self.__presenting = None
+
+
+    def report(self):
+        """
+        Returns a printable summary and histogram of both latencies.
+        """
+        labels = [f"< {edge * 1000:g} ms" for edge in self.EDGES] + [f">= {self.EDGES[-1] * 1000:g} ms"]
+        lines = []
+        for name, stats in (("fetch to MIDI", self.fetch_to_midi), ("fetch to pixels", self.fetch_to_pixels)):
+            lines.append(f"Latency {name}: {stats}")
+            for label, count in zip(labels, stats.histogram(self.EDGES)):
+                lines.append(f"  {label:>10}: {count}")
+        return "\n".join(lines)
+
+
+
+
+class WakeProbe:
+    """
+    Measures how long the main loop takes to wake up from its blocking wait on the event
+    queue.  While the main loop is waiting, a helper thread posts a custom event stamped
+    with `time.perf_counter()` every `interval` seconds, and the time from posting to
+    the wait returning with it is recorded in `latency`.  Probes go through the same
+    queue and wake up as input from SDL does, so this is the wake latency the first
+    touch after idling sees.
+    """
+
+
+    def __init__(self, interval=.1, capacity=4096):
+        """
+        This is a cold path.
+        """
+
+        self.interval = interval
+        self.event_type = pygame.event.custom_type()
+        self.latency = RollingStats(capacity)
+
+        # When the main loop started waiting, or None while it is not waiting.
+        self.__waiting_since = None
+
+        self.__running = False
+        self.__thread = None
+        self.__stop = threading.Event()
+
+
+    def start(self):
+        """
+        This is a cold path.
+        """
+        if self.__thread is None:
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, name="MollyTime wake probe", daemon=True)
+            self.__thread.start()
+
+
+    def stop(self):
+        """
+        This is a cold path.
+        """
+        if self.__thread is not None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+
+
+    def waiting(self):
+        """
+        Called by the main loop right before it blocks on the event queue.
+
+        This is a hot path.
+        """
+        self.__waiting_since = time.perf_counter()
+
+
+    def woke(self, event):
+        """
+        Called by the main loop with the event its wait returned.  A probe posted while
+        the main loop was waiting is measured, and anything else is ignored.
+
+        This is a hot path.
+        """
+        now = time.perf_counter()
+        since = self.__waiting_since
+        self.__waiting_since = None
+        if event.type == self.event_type and since is not None and event.stamp >= since:
+            self.latency.add(now - event.stamp)
+
+
+    def __run(self):
+        while not self.__stop.wait(self.interval):
+            if self.__waiting_since is not None:
+                pygame.event.post(pygame.event.Event(self.event_type, stamp=time.perf_counter()))
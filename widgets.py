@@ -1,5 +1,8 @@
 
+import sys
+import math
 import time
+from array import array
 
 import pygame_setup
 import pygame
@@ -7,6 +10,18 @@ import pygame
 from color import random_color
 import surface_tools
 import midi
+import midi_input
+from timing import LatencyMonitor, WakeProbe, event_time
+from input_log import InputRecorder
+from atlas import TileAtlas
+
+
+
+
+# Press state flags used by `PlaySurface.crank`.
+WAS_HELD = 1
+IS_HELD = 2
+PRESSED = 4
 
 
 
@@ -15,9 +30,32 @@ class Tile:
     """
     The Tile is the basic interactive element of the gui.  A Tile is always created by
     a Plato subclass and never directly.
+
+    Tiles use slots to stay small in large layouts.  Subclasses should declare slots
+    for their own attributes too, or they will get a `__dict__` like any other object.
     """
 
 
+    __slots__ = ("draw_params", "bounding_rect", "tile_id")
+
+
+    # Names of attributes holding surfaces that the tile swaps into its draw_params,
+    # such as the idle and held appearance.  These are repacked along with the
+    # surfaces in draw_params when a texture atlas is built.
+    surface_attrs = ()
+
+    # The resolution `rub` cares about as an `(x_steps, y_steps)` tuple.  When set, the
+    # play surface divides the tile into that many cells along each axis and only calls
+    # `rub` when the press moves into a different cell.  An axis with 0 steps is
+    # ignored, so `(0, 0)` means `rub` is never called.  None calls `rub` on every move.
+    rub_steps = None
+
+    # How far in cells the press must move past the edge of its current cell before it
+    # counts as having moved into the next one, which keeps a jittering finger resting
+    # on a cell edge from flipping between two cells.  Only used with `rub_steps`.
+    rub_hysteresis = 0.0
+
+
     def __init__(self, rect, color):
         """
         This is a cold path.
@@ -27,12 +65,18 @@ class Tile:
         surface = surface_tools.rect((rect.w, rect.h), color)
 
         # The parameters needed to draw this object.  A tile can draw multiple surfaces.
+        # Assign a new list rather than modifying this one in place when the tile's
+        # appearance changes so that the play surface can tell it needs to be redrawn.
         self.draw_params = [(surface, rect)]
 
         # The bounding rect that is the union of all rects from self.draw_params.
         # Filled in automatically by the play surface.
         self.bounding_rect = None
 
+        # The tile's index in the play surface's tile list.  Filled in automatically by
+        # the play surface.
+        self.tile_id = -1
+
 
     def hold(self, x, y):
         """
@@ -65,6 +109,16 @@ class Tile:
         pass
 
 
+    def light(self, on):
+        """
+        Called when a note this Tile plays starts or stops arriving on the MIDI input,
+        if the Tile has a `note` attribute.  Never called while the Tile is held.
+
+        This is a hot path.
+        """
+        pass
+
+
 
 
 class Plato:
@@ -77,6 +131,15 @@ class Plato:
     """
 
 
+    # Set by subclasses whose `match` override always finds the same tile as the
+    # default `Plato.match` does, only faster.  The play surface can then map the
+    # plate's tiles straight into its hit map, and only calls `match` where a hit map
+    # cell is not covered by a single tile.  Otherwise an overridden `match` is called
+    # for every point within the frame.  Subclasses that override `match` again should
+    # set this back to False unless the same holds for them.
+    exact_match = False
+
+
     def __init__(self, x, y, w, h):
         """
         Args `x`, `y`, `w`, and `h` are specified as pip counts.
@@ -169,8 +232,11 @@ class PlaySurface:
     """
 
 
-    def __init__(self, screen_size, plates, horizontal_align=.5, vertical_align=.5):
+    def __init__(self, screen_size, plates, horizontal_align=.5, vertical_align=.5, use_atlas=False):
         """
+        When `use_atlas` is set, the surfaces of all tiles are packed into a texture
+        atlas once the plates are populated.  The TileAtlas is kept in `self.atlas`.
+
         This is a cold path.
         """
 
@@ -212,33 +278,325 @@ class PlaySurface:
         for plate in plates:
             plate.populate(pip_rect)
 
+        # Every tile on the play surface in draw order.  A tile's index in this list is
+        # its id, which indexes the hit map and the per-tile state arrays below.
+        self.tiles = []
+
         for plate in plates:
             for tile in plate.get_tiles():
-                # Used to track rubbing.
-                tile.__last_xy = (None, None)
-                tile.__next_xy = (None, None)
                 first, *rest = [rect for surface, rect in tile.draw_params]
                 tile.bounding_rect = first.unionall(rest)
-
+                tile.tile_id = len(self.tiles)
+                self.tiles.append(tile)
+
+        self.atlas = TileAtlas(self.tiles) if use_atlas else None
+
+        self.__build_hit_map(pip_size)
+        self.__find_overlaps(pip_size)
+
+        tile_count = len(self.tiles)
+
+        # Where each tile was last pressed and where it was pressed as of the most recent
+        # input, in normalized tile coordinates, or NaN while the tile is not held.
+        # These are used to track rubbing.
+        self.__last_x = array("d", [math.nan]) * tile_count
+        self.__last_y = array("d", [math.nan]) * tile_count
+        self.__next_x = array("d", [math.nan]) * tile_count
+        self.__next_y = array("d", [math.nan]) * tile_count
+
+        # The rub resolution of each tile, see `Tile.rub_steps`.  Tiles which quantize
+        # are flagged in `__quantized`.  While one is held, the `__low` and `__high`
+        # arrays hold the range of coordinates, hysteresis included, that keep it in the
+        # cell it was last held or rubbed in.  They are NaN for the other tiles, so
+        # every move is outside the range.
+        self.__quantized = bytearray(tile_count)
+        self.__steps_x = array("d", bytes(8 * tile_count))
+        self.__steps_y = array("d", bytes(8 * tile_count))
+        self.__hysteresis = array("d", bytes(8 * tile_count))
+        self.__low_x = array("d", [math.nan]) * tile_count
+        self.__low_y = array("d", [math.nan]) * tile_count
+        self.__high_x = array("d", [math.nan]) * tile_count
+        self.__high_y = array("d", [math.nan]) * tile_count
+        for tile in self.tiles:
+            if tile.rub_steps is not None:
+                steps_x, steps_y = tile.rub_steps
+                self.__quantized[tile.tile_id] = 1
+                self.__steps_x[tile.tile_id] = steps_x or 0
+                self.__steps_y[tile.tile_id] = steps_y or 0
+                self.__hysteresis[tile.tile_id] = tile.rub_hysteresis
+
+        # Maps MIDI note numbers to the ids of the tiles that play them, for lighting
+        # tiles up from MIDI input.
+        self.__note_tiles = {}
+        for tile in self.tiles:
+            note = getattr(tile, "note", None)
+            if note is not None:
+                self.__note_tiles.setdefault(note, []).append(tile.tile_id)
+
+        # `(tile, old_draw_params)` pairs for tiles lit by `midi_message` since the last
+        # crank, which redraws them.
+        self.__lit = []
+
+        # Per-tile press state flags used by `crank` to diff the held tiles.
+        self.__state = bytearray(tile_count)
+
+        # The ids of the tiles held as of the last crank, in the order they were pressed.
+        self.__active = []
+
+        # Maps finger ids, or "m" for the mouse, to the id of the tile they hold.
         self.fingers = {}
-        self.last_held = set()
         self.mouse_state = False
 
+        # When set, `crank` still calls the tile hooks but skips working out what to
+        # redraw, for play surfaces that are never presented.
+        self.headless = False
+
+        # When set, `crank` records how many memory blocks each call left allocated in
+        # `self.allocations`.  Measuring this is not free, so it is off by default.
+        self.count_allocations = False
+        self.allocations = 0
+
+        # The number of motion events discarded by `coalesce_events` so far.
+        self.dropped_events = 0
+
+        # An optional LatencyMonitor which is told when each crank is done.
+        self.latency = None
+
+
+    def __build_hit_map(self, cell_size):
+        """
+        Divides the screen space covered by the plates into a grid of pip sized cells,
+        and records for each cell what the input routing would find there.  A cell
+        that is completely covered by its topmost tile stores that tile's id, a cell
+        that nothing covers stores -1, and any other cell stores -2 minus the index of
+        a short list of probes to be tested in order.  A probe is either a tile with
+        its rects clipped to its plate's frame, or a plate which overrides `match`.
+        Probes are listed in the same order that `Plato.match` and the plate order
+        would have tested them in.  The tiles of plates with `exact_match` are mapped
+        like those of any other plate, but in the probe lists each run of them is
+        replaced by their plate.
+
+        This is a cold path.
+        """
+
+        first, *rest = [plate.frame for plate in self.plates]
+        bounds = first.unionall(rest)
+
+        cell_size = max(int(cell_size), 1)
+        columns = max((bounds.w + cell_size - 1) // cell_size, 1)
+        rows = max((bounds.h + cell_size - 1) // cell_size, 1)
+
+        # The probes touching each cell in order, or None for cells nothing touches.
+        cells = [None] * (columns * rows)
+        hit_map = array("l", [-1]) * (columns * rows)
+        tile_ids = {id(tile): tile_id for tile_id, tile in enumerate(self.tiles)}
+
+        def cover(rect, probe):
+            """
+            Adds a probe to the cells its rect touches.  A cell stores the probe's tile
+            id straight away if the probe comes first there and the rect contains the
+            whole cell.
+            """
+            left = rect.left - bounds.x
+            top = rect.top - bounds.y
+            min_column = max(left // cell_size, 0)
+            max_column = min((rect.right - 1 - bounds.x) // cell_size, columns - 1)
+            min_row = max(top // cell_size, 0)
+            max_row = min((rect.bottom - 1 - bounds.y) // cell_size, rows - 1)
+
+            # The cells this rect contains entirely.
+            inner_min_column = -(-left // cell_size)
+            inner_max_column = (rect.right - bounds.x) // cell_size - 1
+            inner_min_row = -(-top // cell_size)
+            inner_max_row = (rect.bottom - bounds.y) // cell_size - 1
+
+            tile, rects = probe
+            tile_id = tile_ids.get(id(tile), -1) if rects is not None else -1
+
+            for row in range(min_row, max_row + 1):
+                inner_row = inner_min_row <= row <= inner_max_row
+                for column in range(min_column, max_column + 1):
+                    index = row * columns + column
+                    probes = cells[index]
+                    if probes is None:
+                        probes = cells[index] = [probe]
+                    elif probes[-1] is not probe:
+                        probes.append(probe)
+                    if probes[0] is probe and tile_id >= 0 and inner_row and inner_min_column <= column <= inner_max_column:
+                        hit_map[index] = tile_id
+
+        # Maps the ids of the tile probes of plates with `exact_match` to a probe for
+        # their plate.
+        plate_probes = {}
+
+        for plate in self.plates:
+            custom = type(plate).match is not Plato.match
+            if custom and not plate.exact_match:
+                cover(plate.frame, (plate, None))
+            else:
+                plate_probe = (plate, None)
+                for tile in reversed(plate.tiles):
+                    rects = [rect.clip(plate.frame) for surface, rect in tile.draw_params]
+                    rects = tuple(rect for rect in rects if rect.w and rect.h)
+                    probe = (tile, rects)
+                    if custom:
+                        plate_probes[id(probe)] = plate_probe
+                    for rect in rects:
+                        cover(rect, probe)
+
+        candidates = []
+        shared = {}
+
+        for index, probes in enumerate(cells):
+            # Later probes never matter where the first one covers the whole cell.
+            if probes is None or hit_map[index] >= 0:
+                continue
+
+            if plate_probes:
+                collapsed = []
+                for probe in probes:
+                    probe = plate_probes.get(id(probe), probe)
+                    if not collapsed or collapsed[-1] is not probe:
+                        collapsed.append(probe)
+                probes = collapsed
+
+            key = tuple(id(probe) for probe in probes)
+            if key not in shared:
+                shared[key] = len(candidates)
+                candidates.append(tuple(probes))
+            hit_map[index] = -2 - shared[key]
+
+        self.__hit_x = bounds.x
+        self.__hit_y = bounds.y
+        self.__hit_cell = cell_size
+        self.__hit_columns = columns
+        self.__hit_rows = rows
+        self.__hit_map = hit_map
+        self.__hit_candidates = candidates
+
+
+    def __find_overlaps(self, cell_size):
+        """
+        Records for every tile the ids of all tiles whose bounding rects overlap its
+        own, including itself, in draw order.  This is everything that might need to
+        be redrawn when the tile changes appearance.
+
+        This is a cold path.
+        """
+
+        cell_size = max(int(cell_size), 1)
+        buckets = {}
+
+        for tile_id, tile in enumerate(self.tiles):
+            rect = tile.bounding_rect
+            for row in range(rect.top // cell_size, (rect.bottom - 1) // cell_size + 1):
+                for column in range(rect.left // cell_size, (rect.right - 1) // cell_size + 1):
+                    buckets.setdefault((column, row), []).append(tile_id)
+
+        self.__tile_ids = {id(tile): tile_id for tile_id, tile in enumerate(self.tiles)}
+        self.__overlaps = [None] * len(self.tiles)
+
+        for tile_id, tile in enumerate(self.tiles):
+            rect = tile.bounding_rect
+            found = set()
+            for row in range(rect.top // cell_size, (rect.bottom - 1) // cell_size + 1):
+                for column in range(rect.left // cell_size, (rect.right - 1) // cell_size + 1):
+                    for other_id in buckets[(column, row)]:
+                        if other_id not in found and rect.colliderect(self.tiles[other_id].bounding_rect):
+                            found.add(other_id)
+            found.add(tile_id)
+            self.__overlaps[tile_id] = tuple(sorted(found))
+
 
     def test_point(self, point):
         """
+        Returns the tile under a screen space point, or None.
+
+        This is a hot path.
+        """
+        tile_id = self.__test_point(point)
+        return self.tiles[tile_id] if tile_id >= 0 else None
+
+
+    def __test_point(self, point):
+        """
+        Returns the id of the tile under a screen space point, or -1, and records where
+        the tile was pressed.
+
         This is a hot path.
         """
 
         x, y = point
 
-        for plate in self.plates:
-            if tile := plate.match(point):
-                x = (x - tile.bounding_rect.x) / tile.bounding_rect.width
-                y = (y - tile.bounding_rect.y) / tile.bounding_rect.height
-                tile.__next_xy = (x, y)
-                return tile
-        return None
+        column = int(x - self.__hit_x) // self.__hit_cell
+        row = int(y - self.__hit_y) // self.__hit_cell
+        if column < 0 or row < 0 or column >= self.__hit_columns or row >= self.__hit_rows:
+            return -1
+
+        tile_id = self.__hit_map[row * self.__hit_columns + column]
+        if tile_id == -1:
+            return -1
+
+        elif tile_id < -1:
+            tile = None
+            for probe, rects in self.__hit_candidates[-2 - tile_id]:
+                if rects is None:
+                    if tile := probe.match(point):
+                        break
+                else:
+                    for rect in rects:
+                        if rect.collidepoint(point):
+                            tile = probe
+                            break
+                    if tile:
+                        break
+            tile_id = self.__tile_ids.get(id(tile), -1)
+            if tile_id < 0:
+                return -1
+
+        bounds = self.tiles[tile_id].bounding_rect
+        self.__next_x[tile_id] = (x - bounds.x) / bounds.width
+        self.__next_y[tile_id] = (y - bounds.y) / bounds.height
+        return tile_id
+
+
+    def coalesce_events(self, events):
+        """
+        Takes a list of events as returned by `pygame.event.get` and returns a list
+        with every motion event removed that would be superseded by a later motion
+        event from the same finger (or the mouse) before the next crank.  Finger and
+        mouse button events act as barriers and everything else passes through in
+        the original order.
+
+        This is a hot path.
+        """
+
+        moved = set()
+        kept = []
+
+        for event in reversed(events):
+            if event.type == pygame.FINGERMOTION:
+                if event.finger_id in moved:
+                    self.dropped_events += 1
+                    continue
+                moved.add(event.finger_id)
+
+            elif event.type == pygame.MOUSEMOTION:
+                if "m" in moved:
+                    self.dropped_events += 1
+                    continue
+                moved.add("m")
+
+            elif event.type == pygame.FINGERDOWN or event.type == pygame.FINGERUP:
+                moved.discard(event.finger_id)
+
+            elif event.type == pygame.MOUSEBUTTONDOWN or event.type == pygame.MOUSEBUTTONUP:
+                moved.discard("m")
+
+            kept.append(event)
+
+        kept.reverse()
+        return kept
 
 
     def input_event(self, event):
@@ -248,13 +606,14 @@ class PlaySurface:
 
         if event.type == pygame.FINGERDOWN or event.type == pygame.FINGERMOTION:
             point = (round(event.x * (self.screen_w - 1)), round(event.y * (self.screen_h - 1)))
-            if tile := self.test_point(point):
-                self.fingers[event.finger_id] = tile
-            elif self.fingers.get(event.finger_id) is not None:
+            tile_id = self.__test_point(point)
+            if tile_id >= 0:
+                self.fingers[event.finger_id] = tile_id
+            elif event.finger_id in self.fingers:
                 del self.fingers[event.finger_id]
 
         elif event.type == pygame.FINGERUP:
-            if self.fingers.get(event.finger_id) is not None:
+            if event.finger_id in self.fingers:
                 del self.fingers[event.finger_id]
 
         elif event.type == pygame.MOUSEBUTTONDOWN:
@@ -262,18 +621,20 @@ class PlaySurface:
                 return
             self.mouse_state = True
             finger_id = "m"
-            if tile := self.test_point(event.pos):
-                self.fingers[finger_id] = tile
-            elif self.fingers.get(finger_id) is not None:
+            tile_id = self.__test_point(event.pos)
+            if tile_id >= 0:
+                self.fingers[finger_id] = tile_id
+            elif finger_id in self.fingers:
                 del self.fingers[finger_id]
 
         elif event.type == pygame.MOUSEMOTION and self.mouse_state:
             if event.touch:
                 return
             finger_id = "m"
-            if tile := self.test_point(event.pos):
-                self.fingers[finger_id] = tile
-            elif self.fingers.get(finger_id) is not None:
+            tile_id = self.__test_point(event.pos)
+            if tile_id >= 0:
+                self.fingers[finger_id] = tile_id
+            elif finger_id in self.fingers:
                 del self.fingers[finger_id]
 
         elif event.type == pygame.MOUSEBUTTONUP:
@@ -281,10 +642,40 @@ class PlaySurface:
                 return
             self.mouse_state = False
             finger_id = "m"
-            if self.fingers.get(finger_id) is not None:
+            if finger_id in self.fingers:
                 del self.fingers[finger_id]
 
 
+    def held_tiles(self):
+        """
+        Returns the tiles held as of the last crank.
+        """
+        return [self.tiles[tile_id] for tile_id in self.__active]
+
+
+    def midi_message(self, message):
+        """
+        Handles a message from the MIDI input, given as bytes.  Note on and note off
+        light up the tiles that play the note, unless they are held.  The next crank
+        redraws them.
+
+        This is a hot path.
+        """
+        if len(message) < 3:
+            return
+        status = message[0] & 0xF0
+        if status == midi_input.NOTE_ON or status == midi_input.NOTE_OFF:
+            on = status == midi_input.NOTE_ON and message[2] > 0
+            state = self.__state
+            for tile_id in self.__note_tiles.get(message[1], ()):
+                if not state[tile_id]:
+                    tile = self.tiles[tile_id]
+                    draw_params = tile.draw_params
+                    tile.light(on)
+                    if tile.draw_params != draw_params:
+                        self.__lit.append((tile, draw_params))
+
+
     def draw(self):
         """
         This is a hot path.
@@ -301,38 +692,215 @@ class PlaySurface:
         return update_rects, blit_sequence
 
 
-    def crank(self):
+    def redraw(self, changed):
         """
+        Takes a list of `(tile, old_draw_params)` pairs for tiles that changed their
+        appearance, and returns the screen rects that need to be updated and the blit
+        sequence that repaints them.  Only the areas covered by the changed tiles are
+        repainted, but everything overlapping those areas is repainted in draw order.
+
         This is a hot path.
         """
 
-        held = set(self.fingers.values())
+        regions = []
+        blit_sequence = []
 
-        released = self.last_held - held
-        pressed = held - self.last_held
-        sustained = held & self.last_held
+        for tile, old_params in changed:
+            overlaps = self.__overlaps[tile.tile_id]
+            tile_regions = []
+            for surface, rect in old_params:
+                if rect not in tile_regions:
+                    tile_regions.append(rect)
+            for surface, rect in tile.draw_params:
+                if rect not in tile_regions:
+                    tile_regions.append(rect)
+
+            for region in tile_regions:
+                regions.append(region)
+                for other_id in overlaps:
+                    for surface, rect in self.tiles[other_id].draw_params:
+                        clip = rect.clip(region)
+                        if clip.w and clip.h:
+                            blit_sequence.append((surface, clip, clip.move(-rect.x, -rect.y)))
+
+        return self.merge_rects(regions), blit_sequence
+
+
+    @staticmethod
+    def merge_rects(rects):
+        """
+        Combines rects that overlap or abut whenever their union does not cover more
+        area than the two rects did separately, and returns the resulting list.
 
-        self.last_held = held
+        This is a hot path.
+        """
+
+        merged = []
+        for rect in rects:
+            rect = pygame.Rect(rect)
+            index = 0
+            while index < len(merged):
+                other = merged[index]
+                union = rect.union(other)
+                if union.w * union.h <= rect.w * rect.h + other.w * other.h:
+                    rect = union
+                    del merged[index]
+                    index = 0
+                else:
+                    index += 1
+            merged.append(rect)
+        return merged
+
+
+    def __enter_cell(self, tile_id, x, y):
+        """
+        Records the range of coordinates, hysteresis included, that keeps a quantizing
+        tile in the cell it is now held in.  Presses that slide off the edge of a tile
+        are counted as being in the cells along that edge.
+
+        This is a hot path.
+        """
+        hysteresis = self.__hysteresis[tile_id]
+
+        steps = self.__steps_x[tile_id]
+        low = -math.inf
+        high = math.inf
+        if steps:
+            cell = x * steps // 1
+            if cell < 0:
+                cell = 0
+            elif cell > steps:
+                cell = steps
+            if cell > 0:
+                low = (cell - hysteresis) / steps
+            if cell < steps:
+                high = (cell + 1 + hysteresis) / steps
+        self.__low_x[tile_id] = low
+        self.__high_x[tile_id] = high
+
+        steps = self.__steps_y[tile_id]
+        low = -math.inf
+        high = math.inf
+        if steps:
+            cell = y * steps // 1
+            if cell < 0:
+                cell = 0
+            elif cell > steps:
+                cell = steps
+            if cell > 0:
+                low = (cell - hysteresis) / steps
+            if cell < steps:
+                high = (cell + 1 + hysteresis) / steps
+        self.__low_y[tile_id] = low
+        self.__high_y[tile_id] = high
 
-        for tile in released:
-            tile.release()
-            tile.__last_xy = (None, None)
-            tile.__next_xy = (None, None)
 
-        for tile in pressed:
-            tile.hold(*tile.__next_xy)
-            tile.__last_xy = tile.__next_xy
+    def crank(self):
+        """
+        Diffs the tiles held by fingers against the tiles held as of the last crank, and
+        calls `release`, `hold`, and `rub` on the tiles as needed, in that order.  The
+        diff is done with flags in a preallocated per-tile state array, so apart from
+        what the tiles do, this does not allocate unless something needs redrawing.
+        Tiles with `rub_steps` are only rubbed when the press changes cells.
 
-        rubbed = set()
-        for tile in sustained:
-            if tile.__next_xy != tile.__last_xy:
-                tile.rub(*tile.__next_xy)
-                tile.__last_xy = tile.__next_xy
-                rubbed.add(tile)
+        This is a hot path.
+        """
 
-        if pressed or released or rubbed:
+        if self.count_allocations:
+            blocks = sys.getallocatedblocks()
+
+        state = self.__state
+        active = self.__active
+        held = self.fingers.values()
+        last_x = self.__last_x
+        last_y = self.__last_y
+        next_x = self.__next_x
+        next_y = self.__next_y
+        tiles = self.tiles
+        quantized = self.__quantized
+        low_x = self.__low_x
+        low_y = self.__low_y
+        high_x = self.__high_x
+        high_y = self.__high_y
+
+        # The state of each tile is WAS_HELD if it was held as of the last crank, plus
+        # IS_HELD if a finger holds it now.
+        for tile_id in held:
+            state[tile_id] |= IS_HELD
+
+        changed = None
+        sent_midi = False
+
+        if self.__lit:
+            changed = self.__lit
+            self.__lit = []
+
+        for tile_id in active:
+            if state[tile_id] == WAS_HELD:
+                tile = tiles[tile_id]
+                draw_params = tile.draw_params
+                tile.release()
+                last_x[tile_id] = last_y[tile_id] = math.nan
+                next_x[tile_id] = next_y[tile_id] = math.nan
+                sent_midi = True
+                if tile.draw_params != draw_params:
+                    changed = changed or []
+                    changed.append((tile, draw_params))
+
+        for tile_id in held:
+            if state[tile_id] == IS_HELD:
+                state[tile_id] = PRESSED
+                tile = tiles[tile_id]
+                draw_params = tile.draw_params
+                tile.hold(next_x[tile_id], next_y[tile_id])
+                last_x[tile_id] = next_x[tile_id]
+                last_y[tile_id] = next_y[tile_id]
+                if quantized[tile_id]:
+                    self.__enter_cell(tile_id, next_x[tile_id], next_y[tile_id])
+                sent_midi = True
+                if tile.draw_params != draw_params:
+                    changed = changed or []
+                    changed.append((tile, draw_params))
+
+        for tile_id in active:
+            if state[tile_id] == WAS_HELD | IS_HELD:
+                x = next_x[tile_id]
+                y = next_y[tile_id]
+                if x != last_x[tile_id] or y != last_y[tile_id]:
+                    last_x[tile_id] = x
+                    last_y[tile_id] = y
+                    if low_x[tile_id] <= x < high_x[tile_id] and low_y[tile_id] <= y < high_y[tile_id]:
+                        continue
+                    if quantized[tile_id]:
+                        self.__enter_cell(tile_id, x, y)
+                    tile = tiles[tile_id]
+                    draw_params = tile.draw_params
+                    tile.rub(x, y)
+                    sent_midi = True
+                    if tile.draw_params != draw_params:
+                        changed = changed or []
+                        changed.append((tile, draw_params))
+
+        # Roll the state over to the next crank.
+        for tile_id in active:
+            state[tile_id] = 0
+        active.clear()
+        for tile_id in held:
+            if state[tile_id] != WAS_HELD:
+                state[tile_id] = WAS_HELD
+                active.append(tile_id)
+
+        if sent_midi:
             midi.flush()
-            return self.draw()
+
+        if self.latency:
+            self.latency.cranked(sent_midi, changed is not None)
+
+        if self.count_allocations:
+            self.allocations = sys.getallocatedblocks() - blocks
+
+        if changed and not self.headless:
+            return self.redraw(changed)
 
         else:
             return None, None
@@ -352,7 +920,7 @@ class Instrument:
     instrument.
     """
 
-    def __init__(self, plates, horizontal_align=.5, vertical_align=1):
+    def __init__(self, plates, horizontal_align=.5, vertical_align=1, idle_timeout=.25, frame_rate=60, measure_latency=False, record_path=None, use_atlas=False, disk_cache=False):
         """
         The `plates` argument is a list of Plato subclasses.
 
@@ -361,12 +929,44 @@ class Instrument:
         0 and 1 inclusive, with 0 being the top left corner of the screen and 1 being
         the bottom right corner.  The default is center bottom.
 
+        While no finger is down the main loop blocks on the event queue instead of
+        polling it.  The `idle_timeout` argument is the longest time in seconds it will
+        block before running an iteration of the main loop anyway.  The `frame_rate`
+        argument is only used to report how often waking up took longer than a frame.
+
+        When `measure_latency` is set, the time from input being fetched to the
+        resulting MIDI output being flushed and to the resulting pixels being presented
+        is tracked in `self.latency` and reported on exit.  pygame does not say when SDL
+        received an event, so neither measurement includes the time the event waited
+        before the main loop fetched it, see `timing.event_time`.  That wait is measured
+        separately while idling by `self.wake_probe`, see `timing.WakeProbe`.
+
+        When `record_path` is set, touch and mouse input is recorded to that file so the
+        session can be replayed later with `input_log.replay`.
+
+        When `use_atlas` is set, tile surfaces are packed into a texture atlas at
+        startup, see `atlas.TileAtlas`.
+
+        When `disk_cache` is set, rendered labels are kept in a cache on disk so the
+        next launch can skip rendering them, see `surface_cache.SurfaceCache`.
+
+        When MIDI input has been started, see `midi.start_input`, tiles light up for
+        the notes arriving on it.
+
         This is a cold path.
         """
 
         self.plates = plates
         self.h_align = horizontal_align
         self.v_align = vertical_align
+        self.idle_timeout = idle_timeout
+        self.frame_rate = frame_rate
+
+        self.latency = LatencyMonitor() if measure_latency else None
+        self.wake_probe = WakeProbe() if measure_latency else None
+        self.record_path = record_path
+        self.use_atlas = use_atlas
+        self.disk_cache = disk_cache
 
     def __call__(self):
         """
@@ -384,16 +984,76 @@ class Instrument:
         screen.fill((0, 0, 0))
         pygame.display.flip()
 
-        play_surface = PlaySurface(display_size, self.plates, self.h_align, self.v_align)
+        if self.disk_cache:
+            surface_tools.enable_disk_cache()
+
+        play_surface = PlaySurface(display_size, self.plates, self.h_align, self.v_align, self.use_atlas)
+        surface_tools.save_disk_cache()
+        if play_surface.atlas:
+            print(play_surface.atlas.report())
+        play_surface.latency = self.latency
 
         update_rects, blit_sequence = play_surface.draw()
         screen.blits(blit_sequence=blit_sequence)
         pygame.display.flip()
 
+        idle_timeout = max(int(self.idle_timeout * 1000), 1)
+
+        # When MIDI input is running, its reader thread posts this event to wake the
+        # main loop, which then drains the input queue.
+        input_queue = midi.input_queue
+        if input_queue is not None:
+            midi_input_event = pygame.event.custom_type()
+            input_queue.notify = lambda: pygame.event.post(pygame.event.Event(midi_input_event))
+
+        recorder = None
+        if self.record_path:
+            recorder = InputRecorder(self.record_path, display_size)
+
+        wake_probe = self.wake_probe
+        if wake_probe:
+            wake_probe.start()
+
+        # Seconds until an output stage next needs `midi.poll`, or None.
+        poll_due = None
+
         while True:
             live = True
+            woke = None
 
-            for event in pygame.event.get():
+            if play_surface.fingers:
+                events = pygame.event.get()
+                if events and self.latency:
+                    self.latency.arrived(event_time(events[0]))
+            else:
+                timeout = idle_timeout
+                if poll_due is not None:
+                    timeout = min(timeout, max(int(poll_due * 1000), 1))
+                if wake_probe:
+                    wake_probe.waiting()
+                event = pygame.event.wait(timeout)
+                if wake_probe:
+                    wake_probe.woke(event)
+                if event.type == pygame.NOEVENT:
+                    events = []
+                elif wake_probe and event.type == wake_probe.event_type:
+                    events = pygame.event.get()
+                    if events and self.latency:
+                        self.latency.arrived(event_time(events[0]))
+                else:
+                    woke = event_time(event)
+                    events = [event] + pygame.event.get()
+                    if self.latency:
+                        self.latency.arrived(woke)
+
+            if recorder and events:
+                stamp = woke or event_time(events[0])
+                batch_start = True
+                for event in events:
+                    if recorder.record(event, stamp, batch_start):
+                        batch_start = False
+
+            for event in play_surface.coalesce_events(events):
                 if event.type == pygame.QUIT:
                     live = False
 
@@ -406,13 +1066,40 @@ class Instrument:
             if not live:
                 break
 
+            if input_queue is not None:
+                for stamp, message in input_queue.drain():
+                    play_surface.midi_message(message)
+
             update_rects, blit_sequence = play_surface.crank()
+            poll_due = midi.poll()
 
             if blit_sequence:
                 screen.blits(blit_sequence=blit_sequence)
                 pygame.display.update(update_rects)
-            else:
+                if self.latency:
+                    self.latency.presented()
+            elif woke is None:
                 time.sleep(1e-9)
 
+        if wake_probe:
+            wake_probe.stop()
+
+        if recorder:
+            recorder.close()
+            print(f"Recorded {recorder.records} input events to {self.record_path}")
+
+        if input_queue is not None:
+            input_queue.notify = None
+            print(f"Received {input_queue.received} MIDI messages, at most {input_queue.peak} waiting at once")
+
         surface_tools.reset_memo()
         pygame.quit()
+
+        if wake_probe and wake_probe.latency.count:
+            frame_time = 1 / self.frame_rate
+            slow = sum(1 for sample in wake_probe.latency.recent() if sample > frame_time)
+            print(f"Wake latency: {wake_probe.latency}")
+            print(f"Wakes slower than one frame at {self.frame_rate} Hz: {slow}")
+
+        if self.latency:
+            print(self.latency.report())